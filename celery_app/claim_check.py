@@ -0,0 +1,144 @@
+"""
+Claim-check para payloads grandes en mensajes de Celery
+
+Los blobs grandes (ej: la imagen de firma en base64) se guardan una sola vez
+en un almacén direccionado por contenido y por el broker solo viaja la
+referencia "claim:sha256:<digest>". El worker resuelve la referencia y
+verifica que el contenido coincida con el digest.
+
+Backends (CLAIM_CHECK_BACKEND):
+    off   - deshabilitado, los mensajes llevan el payload completo
+    redis - claves con TTL en Redis (CLAIM_CHECK_TTL segundos)
+    file  - archivos en CLAIM_CHECK_DIR (volumen compartido entre servicios)
+
+Las entradas de la dead-letter queue no expiran, así que se guardan con los
+blobs ya resueltos (ver procesar_entrega) y no dependen de CLAIM_CHECK_TTL.
+"""
+
+import hashlib
+import os
+from typing import Iterable, Optional
+
+import redis
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CLAIM_PREFIX = "claim:sha256:"
+
+CLAIM_CHECK_BACKEND = os.getenv("CLAIM_CHECK_BACKEND", "off")
+CLAIM_CHECK_THRESHOLD = int(os.getenv("CLAIM_CHECK_THRESHOLD", "4096"))
+CLAIM_CHECK_TTL = int(os.getenv("CLAIM_CHECK_TTL", str(7 * 24 * 3600)))
+CLAIM_CHECK_DIR = os.getenv("CLAIM_CHECK_DIR", "/data/blobs")
+
+# Campos de confirmacion_info (procesar_entrega) que viajan como referencia
+CONFIRMACION_CLAIM_FIELDS = ("firma_recibe",)
+
+
+class ClaimCheckError(Exception):
+    """La referencia no existe, expiró o su contenido no coincide con el digest"""
+
+
+class ClaimCheckUnavailableError(ClaimCheckError):
+    """El almacén de blobs no respondió (ej: Redis caído)"""
+
+
+_client = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            os.getenv(
+                "CLAIM_CHECK_REDIS_URL",
+                os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"),
+            )
+        )
+    return _client
+
+
+def _blob_path(digest: str) -> str:
+    return os.path.join(CLAIM_CHECK_DIR, digest[:2], digest)
+
+
+def is_claim_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(CLAIM_PREFIX)
+
+
+def store_blob(data: str) -> str:
+    """Guarda el blob (idempotente por contenido) y retorna su referencia"""
+    raw = data.encode("utf-8")
+    digest = hashlib.sha256(raw).hexdigest()
+
+    if CLAIM_CHECK_BACKEND == "redis":
+        client = _redis()
+        key = f"{CLAIM_PREFIX}{digest}"
+        try:
+            if not client.set(key, raw, ex=CLAIM_CHECK_TTL, nx=True):
+                client.expire(key, CLAIM_CHECK_TTL)
+        except redis.RedisError as e:
+            raise ClaimCheckUnavailableError(f"No se pudo guardar el blob: {e}") from e
+    elif CLAIM_CHECK_BACKEND == "file":
+        path = _blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as blob_file:
+                blob_file.write(raw)
+            os.replace(tmp_path, path)
+    else:
+        raise ClaimCheckError(f"Backend de claim-check no soportado: {CLAIM_CHECK_BACKEND}")
+
+    return f"{CLAIM_PREFIX}{digest}"
+
+
+def load_blob(ref: str) -> str:
+    """Resuelve una referencia verificando el digest del contenido"""
+    digest = ref[len(CLAIM_PREFIX):]
+
+    raw: Optional[bytes] = None
+    if CLAIM_CHECK_BACKEND == "redis":
+        try:
+            raw = _redis().get(ref)
+        except redis.RedisError as e:
+            raise ClaimCheckUnavailableError(f"No se pudo leer el blob {ref}: {e}") from e
+    elif CLAIM_CHECK_BACKEND == "file":
+        try:
+            with open(_blob_path(digest), "rb") as blob_file:
+                raw = blob_file.read()
+        except OSError:
+            raw = None
+
+    if raw is None:
+        raise ClaimCheckError(f"Blob no encontrado o expirado: {ref}")
+    if hashlib.sha256(raw).hexdigest() != digest:
+        raise ClaimCheckError(f"El contenido del blob no coincide con su digest: {ref}")
+    return raw.decode("utf-8")
+
+
+def check_in(info: dict, fields: Iterable[str]) -> dict:
+    """Reemplaza los campos grandes de info por referencias (si el claim-check está activo)"""
+    if CLAIM_CHECK_BACKEND == "off" or not info:
+        return info
+
+    result = dict(info)
+    for field in fields:
+        value = result.get(field)
+        if isinstance(value, str) and not is_claim_ref(value) and len(value) >= CLAIM_CHECK_THRESHOLD:
+            result[field] = store_blob(value)
+            logger.info(f"📎 {field} ({len(value)} bytes) almacenado como {result[field][:24]}...")
+    return result
+
+
+def check_out(info: dict, fields: Iterable[str]) -> dict:
+    """Resuelve las referencias de info a su contenido original"""
+    if not info:
+        return info
+
+    result = dict(info)
+    for field in fields:
+        if is_claim_ref(result.get(field)):
+            result[field] = load_blob(result[field])
+    return result
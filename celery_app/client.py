@@ -19,6 +19,8 @@ flask_celery.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    # Publicar task-sent para el índice de tareas del monitor
+    task_send_sent_event=True,
 )
 
 print("✓ Flask Celery configurado para dispatch")
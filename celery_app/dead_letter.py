@@ -0,0 +1,202 @@
+"""
+Dead-letter queue para tareas que agotaron sus reintentos
+
+Las tareas fallidas se guardan como JSON en una lista de Redis (FIFO) y se
+pueden re-despachar en lotes con límite de tasa para drenar el backlog sin
+generar una avalancha de mensajes sobre el broker.
+
+Durante el replay cada entrada se mueve con LMOVE a una lista de
+procesamiento y solo se borra cuando su envío fue exitoso; si el replay se
+interrumpe, el siguiente devuelve esas entradas a la DLQ antes de empezar.
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import redis
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DLQ_PREFIX = "dlq:"
+DLQ_REPLAY_LOCK_TTL = int(os.getenv("DLQ_REPLAY_LOCK_TTL", "300"))
+
+_client = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            os.getenv(
+                "DLQ_REDIS_URL",
+                os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"),
+            )
+        )
+    return _client
+
+
+def dlq_key(task_name: str) -> str:
+    return f"{DLQ_PREFIX}{task_name}"
+
+
+def processing_key(task_name: str) -> str:
+    return f"{DLQ_PREFIX}processing:{task_name}"
+
+
+def _recover_processing(client, key: str, processing: str) -> int:
+    """Devuelve al inicio de la DLQ (en su orden original) las entradas de un replay interrumpido"""
+    recovered = 0
+    while client.lmove(processing, key, "RIGHT", "LEFT") is not None:
+        recovered += 1
+    if recovered:
+        logger.warning(f"♻️ {recovered} entradas de un replay interrumpido devueltas a {key}")
+    return recovered
+
+
+def push_dead_letter(
+    task_name: str,
+    args: list,
+    task_id: Optional[str] = None,
+    error: Optional[str] = None,
+) -> int:
+    """Agrega una tarea a la dead-letter queue. Retorna el tamaño de la cola"""
+    entry = {
+        "task_name": task_name,
+        "args": list(args),
+        "task_id": task_id,
+        "error": error,
+        "failed_at": datetime.now().isoformat(),
+    }
+    size = _redis().rpush(dlq_key(task_name), json.dumps(entry))
+    logger.warning(f"☠️ Tarea {task_name} ({task_id}) enviada a la DLQ ({size} pendientes)")
+    return size
+
+
+def dead_letter_count(task_name: str) -> int:
+    return _redis().llen(dlq_key(task_name))
+
+
+def peek_dead_letters(task_name: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """Lista las primeras entradas de la cola sin consumirlas"""
+    return [json.loads(raw) for raw in _redis().lrange(dlq_key(task_name), 0, limit - 1)]
+
+
+def replay_dead_letters(
+    task_name: str,
+    dispatch,
+    batch_size: int = 100,
+    rate_per_second: float = 200,
+    max_items: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Re-despacha las tareas de la DLQ en lotes con límite de tasa.
+
+    Args:
+        task_name: Tarea cuya DLQ se drena
+        dispatch: Función que recibe las entradas de un lote y las re-despacha
+            juntas. Retorna un dict por entrada (mismo orden), sin 'error' si
+            el envío de esa entrada fue exitoso.
+        batch_size: Entradas extraídas de Redis por lote
+        rate_per_second: Máximo de tareas re-despachadas por segundo
+        max_items: Máximo de entradas a procesar (None para drenar toda la cola)
+
+    Returns:
+        Resumen con el número de tareas re-despachadas y fallidas
+    """
+    client = _redis()
+    key = dlq_key(task_name)
+    processing = processing_key(task_name)
+    replayed = 0
+    failed = 0
+    started = time.monotonic()
+
+    # Un solo replay a la vez: la recuperación movería las entradas en vuelo de otro
+    lock = client.lock(f"{DLQ_PREFIX}replay-lock:{task_name}", timeout=DLQ_REPLAY_LOCK_TTL)
+    if not lock.acquire(blocking=False):
+        return {
+            "task_name": task_name,
+            "error": "Ya hay un replay de la DLQ en curso",
+            "replayed": 0,
+            "failed": 0,
+            "remaining": client.llen(key),
+            "timestamp": datetime.now().isoformat(),
+        }
+
+    try:
+        recovered = _recover_processing(client, key, processing)
+
+        while max_items is None or replayed + failed < max_items:
+            count = batch_size if max_items is None else min(batch_size, max_items - replayed - failed)
+            pipe = client.pipeline(transaction=False)
+            for _ in range(count):
+                pipe.lmove(key, processing, "LEFT", "RIGHT")
+            raw_entries = [raw for raw in pipe.execute() if raw is not None]
+            if not raw_entries:
+                break
+
+            batch_started = time.monotonic()
+            results = [None] * len(raw_entries)
+            entries = []
+            for index, raw in enumerate(raw_entries):
+                try:
+                    entries.append((index, json.loads(raw)))
+                except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                    results[index] = {"error": f"Entrada inválida: {e}"}
+            try:
+                sent = dispatch([entry for _, entry in entries]) if entries else []
+            except Exception as e:
+                sent = [{"error": str(e)}] * len(entries)
+            for (index, _), result in zip(entries, sent):
+                results[index] = result
+
+            sent_entries = []
+            failed_entries = []
+            for raw, result in zip(raw_entries, results):
+                if not result or result.get("error"):
+                    failed += 1
+                    failed_entries.append(raw)
+                else:
+                    replayed += 1
+                    sent_entries.append(raw)
+
+            # Confirmar las enviadas y devolver al final de la DLQ las que fallaron
+            pipe = client.pipeline(transaction=True)
+            for raw in sent_entries:
+                pipe.lrem(processing, 1, raw)
+            for raw in failed_entries:
+                pipe.lrem(processing, 1, raw)
+                pipe.rpush(key, raw)
+            pipe.execute()
+            lock.reacquire()
+
+            if failed_entries:
+                logger.error(f"{len(failed_entries)} entradas de la DLQ no se pudieron re-despachar")
+                break
+
+            # Limitar la tasa: cada lote debe tomar al menos len(lote)/rate segundos
+            min_duration = len(raw_entries) / rate_per_second if rate_per_second else 0
+            elapsed = time.monotonic() - batch_started
+            if elapsed < min_duration:
+                time.sleep(min_duration - elapsed)
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            logger.warning("El lock del replay de la DLQ expiró antes de terminar")
+
+    summary = {
+        "task_name": task_name,
+        "replayed": replayed,
+        "failed": failed,
+        "recovered": recovered,
+        "remaining": client.llen(key),
+        "duration_s": round(time.monotonic() - started, 3),
+        "timestamp": datetime.now().isoformat(),
+    }
+    logger.info(f"♻️ Replay de DLQ completado: {summary}")
+    return summary
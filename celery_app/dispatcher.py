@@ -6,12 +6,15 @@ tener dependencias directas del código de las tareas.
 Usa la instancia de Celery específica para Flask.
 """
 
+import json
 import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterable, List, Optional
 from datetime import datetime
 from celery.result import AsyncResult
 
-from scripts.utils import sign_data
+from scripts.utils import sign_celery_message, sign_celery_messages
+from .claim_check import CONFIRMACION_CLAIM_FIELDS, check_in
+from shared.log_schema import note_task_id, trace_headers
 from .client import flask_celery
 from .task_registry import list_available_tasks, get_task_info, validate_task_params
 import logging
@@ -67,11 +70,7 @@ class TaskDispatcher:
             }
         kwargs = {
             **(kwargs or {}),
-            "signed_celery_message": sign_data(
-                os.getenv("CELERY_SIGNING_KEY", ""),
-                {"task_name": task_name, "args": args},
-            ),
-            "info_internal": {"task_name": task_name, "args": args},
+            "signed_celery_message": sign_celery_message(task_name, args),
         }
         try:
             # Enviar tarea usando Celery (por nombre)
@@ -80,7 +79,9 @@ class TaskDispatcher:
                 args=args,
                 kwargs=kwargs,
                 queue=task_info.get("queue", "celery"),
+                headers=trace_headers(),
             )
+            note_task_id(result.id)
 
             return {
                 "task_id": result.id,
@@ -89,12 +90,82 @@ class TaskDispatcher:
                 "queue": task_info.get("queue", "celery"),
                 "timestamp": datetime.now().isoformat(),
                 "args": args,
-                "kwargs": kwargs,
             }
 
         except Exception as e:
             return {"error": str(e), "task_name": task_name, "status": "FAILED"}
 
+    def dispatch_many(
+        self, task_name: str, list_of_args: Iterable[Iterable[Any]]
+    ) -> Dict[str, Any]:
+        """
+        Envía muchas tareas del mismo tipo reutilizando una sola conexión/producer
+
+        Args:
+            task_name: Nombre completo de la tarea
+            list_of_args: Lista con los argumentos posicionales de cada tarea
+
+        Returns:
+            Dict compacto con los ids (alineados con list_of_args, None si falló)
+            y los errores por índice
+        """
+        if not self.celery:
+            return {"error": "Celery no disponible", "task_name": task_name, "status": "FAILED"}
+
+        task_info = get_task_info(task_name)
+        if not task_info:
+            return {
+                "error": f"Tarea '{task_name}' no encontrada en el registro",
+                "task_name": task_name,
+                "status": "FAILED",
+            }
+        queue = task_info.get("queue", "celery")
+
+        list_of_args = list(list_of_args)
+        errors = []
+        valid = []
+        for index, args in enumerate(list_of_args):
+            args = tuple(args)
+            is_valid, validation_msg = validate_task_params(task_name, args)
+            if is_valid:
+                valid.append((index, args))
+            else:
+                errors.append({"index": index, "error": f"Parámetros inválidos: {validation_msg}"})
+
+        signatures = sign_celery_messages(task_name, [args for _, args in valid])
+
+        task_ids = [None] * len(list_of_args)
+        sent = 0
+        try:
+            with self.celery.producer_or_acquire() as producer:
+                for (index, args), signature in zip(valid, signatures):
+                    try:
+                        result = self.celery.send_task(
+                            task_name,
+                            args=args,
+                            kwargs={"signed_celery_message": signature},
+                            queue=queue,
+                            producer=producer,
+                            headers=trace_headers(),
+                        )
+                        task_ids[index] = result.id
+                        sent += 1
+                    except Exception as e:
+                        errors.append({"index": index, "error": str(e)})
+        except Exception as e:
+            return {"error": str(e), "task_name": task_name, "status": "FAILED", "task_ids": task_ids}
+
+        logger.info(f"📦 {sent} tareas {task_name} enviadas en lote")
+        return {
+            "task_name": task_name,
+            "queue": queue,
+            "status": "PENDING" if not errors else "PARTIAL",
+            "sent": sent,
+            "task_ids": task_ids,
+            "errors": errors,
+            "timestamp": datetime.now().isoformat(),
+        }
+
     def get_task_result(self, task_id: str) -> Dict[str, Any]:
         """Obtiene el resultado completo de una tarea"""
         if not self.celery:
@@ -141,134 +212,177 @@ class TaskDispatcher:
         """Lista tareas disponibles"""
         return list_available_tasks()
 
-    def list_tasks_from_redis(self) -> list:
-        """Lista todas las tareas: activas, pendientes, reservadas y completadas"""
+    def list_tasks_from_redis(
+        self,
+        cursor: int = 0,
+        count: int = 100,
+        state: Optional[str] = None,
+        name: Optional[str] = None,
+        include_inspect: bool = True,
+        scan_budget: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Lista tareas: activas, pendientes y reservadas (solo en la primera página)
+        más una página de resultados del backend recorrida con SCAN.
+
+        Con filtros se sigue recorriendo el backend hasta juntar count tareas que
+        cumplan, terminar el SCAN o leer scan_budget claves (TASK_SCAN_BUDGET).
+
+        Args:
+            cursor: Cursor SCAN devuelto por la página anterior (0 para empezar)
+            count: Número aproximado de resultados por página
+            state: Filtra por estado (ej: SUCCESS, FAILURE, ACTIVE)
+            name: Filtra por nombre de tarea
+            include_inspect: Consultar a los workers con inspect en la primera página
+            scan_budget: Máximo de claves leídas del backend por llamada
+
+        Returns:
+            Dict con 'tasks', 'next_cursor' (0 cuando no hay más páginas),
+            'scanned_keys' y 'scan_budget_exhausted' (True si la página quedó
+            corta por el presupuesto y no por falta de resultados)
+        """
         logger.info("Listando tareas desde Redis backend")
         if not self.celery:
-            return []
+            return {"tasks": [], "next_cursor": 0, "scanned_keys": 0, "scan_budget_exhausted": False}
+
+        if scan_budget is None:
+            scan_budget = int(os.getenv("TASK_SCAN_BUDGET", "10000"))
+
+        def matches(task):
+            return (not state or task.get("state") == state) and (
+                not name or task.get("name") == name
+            )
 
         all_tasks = []
 
+        if cursor == 0 and include_inspect:
+            all_tasks.extend(t for t in self._inspect_worker_tasks() if matches(t))
+
+        next_cursor = cursor
+        scanned = 0
+        rounds = 0
+        while True:
+            try:
+                results, next_cursor, keys_read = self._scan_task_results(next_cursor, count)
+            except Exception as e:
+                logger.error(f"Error obteniendo tareas completadas: {e}")
+                next_cursor = 0
+                break
+            scanned += keys_read
+            rounds += 1
+            all_tasks.extend(t for t in results if matches(t))
+            # Cada vuelta cuesta al menos count pasos de SCAN aunque no lea claves
+            if next_cursor == 0 or len(all_tasks) >= count or max(scanned, rounds * count) >= scan_budget:
+                break
+
+        budget_exhausted = next_cursor != 0 and len(all_tasks) < count
+        logger.info(f"Total de tareas encontradas: {len(all_tasks)} ({scanned} claves leídas)")
+        return {
+            "tasks": all_tasks,
+            "next_cursor": next_cursor,
+            "scanned_keys": scanned,
+            "scan_budget_exhausted": budget_exhausted,
+        }
+
+    def _inspect_worker_tasks(self) -> list:
+        """Obtiene tareas activas/pendientes/reservadas usando inspect"""
+        tasks_found = []
         try:
-            # 1. Obtener tareas activas/pendientes/reservadas usando inspect
             i = self.celery.control.inspect()
 
-            # Tareas activas (en ejecución)
-            active = i.active()
-            if active:
-                for worker, tasks in active.items():
+            for state, tasks_by_worker in (
+                ("ACTIVE", i.active()),  # en ejecución
+                ("SCHEDULED", i.scheduled()),  # en cola
+                ("RESERVED", i.reserved()),
+            ):
+                if not tasks_by_worker:
+                    continue
+                for worker, tasks in tasks_by_worker.items():
                     for task in tasks:
                         task["worker"] = worker
-                        task["state"] = "ACTIVE"
-                        all_tasks.append(task)
-
-            # Tareas pendientes (en cola)
-            scheduled = i.scheduled()
-            if scheduled:
-                for worker, tasks in scheduled.items():
-                    for task in tasks:
-                        task["worker"] = worker
-                        task["state"] = "SCHEDULED"
-                        all_tasks.append(task)
-
-            # Tareas reservadas
-            reserved = i.reserved()
-            if reserved:
-                for worker, tasks in reserved.items():
-                    for task in tasks:
-                        task["worker"] = worker
-                        task["state"] = "RESERVED"
-                        all_tasks.append(task)
+                        task["state"] = state
+                        tasks_found.append(task)
 
             logger.info(
-                f"Tareas activas/pendientes/reservadas encontradas: {len(all_tasks)}"
+                f"Tareas activas/pendientes/reservadas encontradas: {len(tasks_found)}"
             )
-
         except Exception as e:
             logger.error(f"Error obteniendo tareas activas: {e}")
+        return tasks_found
 
-        try:
-            # 2. Obtener tareas completadas desde el backend de resultados
-            backend = self.celery.backend
-
-            if hasattr(backend, "client") and backend.client:
-                # Para Redis backend
-                try:
-                    keys = backend.client.keys("celery-task-meta-*")
-                    logger.info(f"Claves encontradas en Redis backend: {len(keys)}")
-
-                    for key in keys[:100]:  # Limitar a 100 para evitar sobrecarga
-                        try:
-                            if isinstance(key, bytes):
-                                key_str = key.decode("utf-8")
-                            else:
-                                key_str = str(key)
-
-                            task_id = key_str.replace("celery-task-meta-", "")
-
-                            # Usar AsyncResult para obtener información completa
-                            result = AsyncResult(task_id, app=self.celery)
-
-                            # Obtener metadatos del resultado
-                            task_meta = backend.client.get(key)
-                            if task_meta:
-                                import json
-
-                                try:
-                                    meta_data = json.loads(task_meta.decode("utf-8"))
-
-                                    task_info = {
-                                        "id": task_id,
-                                        "name": meta_data.get("task_name", "unknown"),
-                                        "state": result.status,
-                                        "result": meta_data.get("result"),
-                                        "args": meta_data.get("args", []),
-                                        "kwargs": meta_data.get("kwargs", {}),
-                                        "received": meta_data.get("date_received"),
-                                        "finished": meta_data.get("date_done"),
-                                        "worker": "completed",
-                                        "source": "result_backend",
-                                        "metadata": meta_data,
-                                    }
-
-                                    all_tasks.append(task_info)
-
-                                except json.JSONDecodeError:
-                                    # Si no se puede parsear JSON, usar información básica
-                                    all_tasks.append(
-                                        {
-                                            "id": task_id,
-                                            "name": "unknown",
-                                            "state": result.status,
-                                            "result": (
-                                                str(result.result)
-                                                if result.ready()
-                                                else None
-                                            ),
-                                            "args": [],
-                                            "kwargs": {},
-                                            "worker": "completed",
-                                            "source": "result_backend",
-                                        }
-                                    )
-
-                        except Exception as task_error:
-                            logger.error(
-                                f"Error procesando tarea {task_id}: {task_error}"
-                            )
-                            continue
-
-                except Exception as redis_error:
-                    logger.error(f"Error accediendo a Redis backend: {redis_error}")
-
-            else:
-                logger.warning("Backend no es Redis o no tiene cliente disponible")
+    def _scan_task_results(self, cursor: int, count: int):
+        """
+        Recorre las claves celery-task-meta-* con SCAN (sin bloquear Redis como KEYS)
+        y obtiene los metadatos en lote con MGET.
 
-        except Exception as e:
-            logger.error(f"Error obteniendo tareas completadas: {e}")
+        Returns:
+            Tupla (tareas, siguiente_cursor, claves_leídas)
+        """
+        backend = self.celery.backend
+        client = getattr(backend, "client", None)
+        if not client:
+            logger.warning("Backend no es Redis o no tiene cliente disponible")
+            return [], 0, 0
+
+        keys = []
+        seen = set()
+        # SCAN puede devolver menos claves que COUNT por iteración; acotar las vueltas
+        for _ in range(50):
+            cursor, batch = client.scan(
+                cursor=cursor, match="celery-task-meta-*", count=count
+            )
+            for key in batch:
+                if key not in seen:
+                    seen.add(key)
+                    keys.append(key)
+            if cursor == 0 or len(keys) >= count:
+                break
+
+        if not keys:
+            return [], cursor, 0
+
+        values = client.mget(keys)
+        tasks_found = []
+        for key, task_meta in zip(keys, values):
+            key_str = key.decode("utf-8") if isinstance(key, bytes) else str(key)
+            task_id = key_str.replace("celery-task-meta-", "")
+            if not task_meta:
+                continue  # expiró entre SCAN y MGET
+            try:
+                meta_data = json.loads(task_meta)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                tasks_found.append(
+                    {
+                        "id": task_id,
+                        "name": "unknown",
+                        "state": "UNKNOWN",
+                        "result": None,
+                        "args": [],
+                        "kwargs": {},
+                        "worker": "completed",
+                        "source": "result_backend",
+                    }
+                )
+                continue
+
+            tasks_found.append(
+                {
+                    "id": task_id,
+                    "name": meta_data.get("name") or meta_data.get("task_name", "unknown"),
+                    "state": meta_data.get("status"),
+                    "result": meta_data.get("result"),
+                    "args": meta_data.get("args", []),
+                    "kwargs": meta_data.get("kwargs", {}),
+                    "received": meta_data.get("date_received"),
+                    "finished": meta_data.get("date_done"),
+                    "worker": "completed",
+                    "source": "result_backend",
+                    "metadata": meta_data,
+                }
+            )
 
-        logger.info(f"Total de tareas encontradas: {len(all_tasks)}")
-        return all_tasks
+        logger.info(f"Claves leídas del backend en esta página: {len(keys)}")
+        return tasks_found, cursor, len(keys)
 
 
 # Instancia global del dispatcher
@@ -310,6 +424,59 @@ class LogisticaTasks:
             "logistica.generar_reporte", fecha_inicio, fecha_fin, **options
         )
 
+    @staticmethod
+    def replay_dead_letters(
+        batch_size: int = 100,
+        rate_per_second: float = 200,
+        max_items: Optional[int] = None,
+        **options,
+    ):
+        return task_dispatcher.dispatch_task(
+            "logistica.replay_dead_letters",
+            batch_size,
+            rate_per_second,
+            max_items,
+            **options,
+        )
+
+    @staticmethod
+    def redispatch_dead_letters(entries: List[dict]) -> List[Dict[str, Any]]:
+        """
+        Re-despacha un lote de entradas de la DLQ de procesar_entrega con su
+        estado original y un contador de reintentos nuevo, publicadas juntas
+        con dispatch_many.
+
+        La DLQ guarda los blobs resueltos; antes de enviarlos se vuelven a
+        guardar como claim-check para no pasar el payload completo por el broker.
+
+        Returns:
+            Un dict por entrada (mismo orden) con 'task_id' o 'error'
+        """
+        list_of_args = []
+        for entry in entries:
+            entrega_id, status, _retry_count, confirmacion_info = entry["args"]
+            try:
+                confirmacion_info = check_in(confirmacion_info, CONFIRMACION_CLAIM_FIELDS)
+            except Exception as e:
+                logger.warning(f"Claim-check no disponible, re-despachando payload completo: {e}")
+            list_of_args.append((entrega_id, status, 0, confirmacion_info))
+
+        result = task_dispatcher.dispatch_many("logistica.procesar_entrega", list_of_args)
+        task_ids = result.get("task_ids") or [None] * len(entries)
+        errors = {error["index"]: error["error"] for error in result.get("errors", [])}
+        return [
+            {"task_id": task_id}
+            if task_id
+            else {"error": errors.get(index) or result.get("error") or "Tarea no enviada"}
+            for index, task_id in enumerate(task_ids)
+        ]
+
+    @staticmethod
+    def reencriptar_entregas(batch_size: int = 500, **options):
+        return task_dispatcher.dispatch_task(
+            "logistica.reencriptar_entregas", batch_size, **options
+        )
+
 
 class MonitorTasks:
     """Wrapper para tareas de monitoreo"""
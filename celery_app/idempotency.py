@@ -0,0 +1,90 @@
+"""
+Llaves de idempotencia para tareas de Celery
+
+La llave se deriva del id de la entidad y del digest canónico del payload.
+Se reserva con SET NX en Redis durante una ventana (IDEMPOTENCY_WINDOW) en dos
+puntos: antes de despachar ("dispatch") y al iniciar la ejecución en el
+worker ("worker"). El valor guardado es el id de la tarea dueña, así los
+reintentos de la misma tarea no se descartan como duplicados.
+
+Si Redis no está disponible se permite el procesamiento (fail-open).
+"""
+
+import hashlib
+import json
+import os
+from typing import Optional
+
+import redis
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_PREFIX = "idem:"
+IDEMPOTENCY_WINDOW = int(os.getenv("IDEMPOTENCY_WINDOW", "3600"))
+
+_client = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            os.getenv(
+                "IDEMPOTENCY_REDIS_URL",
+                os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"),
+            ),
+            decode_responses=True,
+        )
+    return _client
+
+
+def idempotency_key(entity_id, payload: dict) -> str:
+    """Digest estable de (entidad, payload)"""
+    canonical = json.dumps(
+        {"id": entity_id, "payload": payload}, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _redis_key(scope: str, key: str) -> str:
+    return f"{IDEMPOTENCY_PREFIX}{scope}:{key}"
+
+
+def acquire(scope: str, key: str, owner: str) -> Optional[str]:
+    """
+    Reserva la llave para owner.
+
+    Returns:
+        None si la llave quedó reservada por owner (o ya era suya),
+        o el owner existente si es un duplicado
+    """
+    try:
+        client = _redis()
+        redis_key = _redis_key(scope, key)
+        if client.set(redis_key, owner, nx=True, ex=IDEMPOTENCY_WINDOW):
+            return None
+        existing = client.get(redis_key)
+        if existing is None or existing == owner:
+            return None
+        return existing
+    except redis.RedisError as e:
+        logger.warning(f"Idempotencia no disponible ({scope}), se permite el procesamiento: {e}")
+        return None
+
+
+def set_owner(scope: str, key: str, owner: str) -> None:
+    """Actualiza el dueño de una llave ya reservada conservando su TTL"""
+    try:
+        _redis().set(_redis_key(scope, key), owner, xx=True, keepttl=True)
+    except redis.RedisError as e:
+        logger.warning(f"No se pudo actualizar la llave de idempotencia: {e}")
+
+
+def release(key: str, *scopes: str) -> None:
+    """Libera la llave para permitir un nuevo procesamiento (ej: tras un fallo terminal)"""
+    try:
+        _redis().delete(*[_redis_key(scope, key) for scope in scopes])
+    except redis.RedisError as e:
+        logger.warning(f"No se pudo liberar la llave de idempotencia: {e}")
@@ -0,0 +1,118 @@
+"""
+Eventos estructurados por tarea en el worker (señales de Celery)
+
+Por cada ejecución se emite una línea JSON con el esquema de
+shared.log_schema: duración, tiempo en cola (desde que el dispatcher envió el
+mensaje o desde su ETA en reintentos), estado final y request_id del request
+HTTP que la originó.
+
+Cada ejecución también se cuenta en celery_app.worker_metrics; al terminar
+cada tarea se vuelcan a Redis (cada METRICS_FLUSH_INTERVAL) las
+métricas del proceso para que los servicios vean el agregado del worker.
+
+Si TASK_EVENT_LOG está definido los eventos se escriben solos en ese archivo
+(JSON Lines); si no, van al log del worker.
+
+Las señales se conectan con connect_task_events() desde worker_init, así los
+servicios Flask que importan celery_app no registran handlers ni abren el log.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
+
+from shared.log_schema import build_event
+from shared.metrics import REGISTRY, flush_if_due, flush_to_redis
+from celery_app.worker_metrics import WORKER_REGISTRY, record_task
+
+TASK_EVENT_LOG = os.getenv("TASK_EVENT_LOG")
+
+logger = logging.getLogger("celery_app.task_events")
+logger.setLevel(logging.INFO)
+
+# task_id -> (inicio perf_counter, tiempo en cola ms)
+_started = {}
+_started_lock = threading.Lock()
+
+
+def _header(request, name):
+    """Header custom del mensaje (atributo del request o dict headers según el protocolo)"""
+    value = getattr(request, name, None)
+    if value is None:
+        value = (getattr(request, "headers", None) or {}).get(name)
+    return value
+
+
+def queue_wait_ms(request, started_at):
+    sent_at = _header(request, "sent_at")
+    if sent_at is None:
+        return None
+    available_at = float(sent_at)
+    eta = getattr(request, "eta", None)
+    if eta:
+        # Un reintento con countdown no está "esperando" hasta su ETA
+        try:
+            available_at = max(available_at, datetime.fromisoformat(str(eta)).timestamp())
+        except ValueError:
+            pass
+    return round(max(0.0, started_at - available_at) * 1000, 3)
+
+
+def _on_task_prerun(task_id=None, task=None, **kwargs):
+    queue_wait = queue_wait_ms(task.request, time.time())
+    with _started_lock:
+        _started[task_id] = (time.perf_counter(), queue_wait)
+
+
+def _on_task_postrun(task_id=None, task=None, retval=None, state=None, **kwargs):
+    with _started_lock:
+        started, queue_wait = _started.pop(task_id, (None, None))
+
+    duration_ms = round((time.perf_counter() - started) * 1000, 3) if started else None
+    record_task(task.name, state, duration_ms, queue_wait)
+
+    event = build_event(
+        "task",
+        service="worker",
+        request_id=_header(task.request, "request_id"),
+        status=state,
+        duration_ms=duration_ms,
+        queue_wait_ms=queue_wait,
+        task_id=task_id,
+        task_name=task.name,
+        retries=task.request.retries,
+        queue=(task.request.delivery_info or {}).get("routing_key"),
+        result_status=retval.get("status") if isinstance(retval, dict) else None,
+    )
+    logger.info(json.dumps(event, default=str))
+    flush_if_due(REGISTRY, WORKER_REGISTRY)
+
+
+def _on_worker_process_shutdown(**kwargs):
+    for registry in (REGISTRY, WORKER_REGISTRY):
+        try:
+            flush_to_redis(registry)
+        except Exception as e:
+            logger.warning(f"No se pudieron volcar las métricas al cerrar el proceso: {e}")
+
+
+def connect_task_events():
+    """Conecta los handlers de las señales y el archivo de eventos (solo en el worker)"""
+    if TASK_EVENT_LOG and not logger.handlers:
+        os.makedirs(os.path.dirname(TASK_EVENT_LOG) or ".", exist_ok=True)
+        handler = logging.FileHandler(TASK_EVENT_LOG)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+
+    # dispatch_uid evita handlers duplicados si se llama más de una vez
+    task_prerun.connect(_on_task_prerun, weak=False, dispatch_uid="task_events.prerun")
+    task_postrun.connect(_on_task_postrun, weak=False, dispatch_uid="task_events.postrun")
+    worker_process_shutdown.connect(
+        _on_worker_process_shutdown, weak=False, dispatch_uid="task_events.shutdown"
+    )
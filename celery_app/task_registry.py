@@ -26,6 +26,20 @@ TASK_REGISTRY = {
         'timeout': 600,
         'module': 'microservices.logistica_inventario.tasks'
     },
+    'logistica.reencriptar_entregas': {
+        'description': 'Migra campos cifrados legacy (AES-CBC) al formato AES-GCM',
+        'params': ['batch_size'],
+        'queue': 'logistica',
+        'timeout': 3600,
+        'module': 'microservices.logistica_inventario.tasks'
+    },
+    'logistica.replay_dead_letters': {
+        'description': 'Re-despacha entregas de la dead-letter queue con límite de tasa',
+        'params': ['batch_size', 'rate_per_second', 'max_items'],
+        'queue': 'logistica',
+        'timeout': 3600,
+        'module': 'microservices.logistica_inventario.tasks'
+    },
     
     # Tareas de Monitor
     'monitor.health_check': {
@@ -28,6 +28,9 @@ worker_celery.conf.update(
     result_expires=3600,
     worker_prefetch_multiplier=1,
     task_acks_late=True,
+    # Eventos para el índice de tareas del monitor
+    worker_send_task_events=True,
+    task_send_sent_event=True,
     task_routes={
         'logistica.*': {'queue': 'logistica'},
         'monitor.*': {'queue': 'monitor'},
@@ -40,6 +43,24 @@ worker_celery.autodiscover_tasks([
     'microservices.monitor.tasks',
 ])
 
+from celery.signals import worker_init  # noqa: E402
+
+
+@worker_init.connect
+def _setup_worker_observability(**kwargs):
+    """
+    Solo en el proceso principal del worker (los procesos del pool heredan las
+    señales al hacer fork): un evento JSON por ejecución de tarea y /metrics
+    con el agregado de todo el pool vía Redis.
+    """
+    from celery_app.task_events import connect_task_events
+    from celery_app.worker_metrics import WORKER_METRICS_PORT, start_metrics_server
+
+    connect_task_events()
+    if WORKER_METRICS_PORT:
+        start_metrics_server(WORKER_METRICS_PORT)
+
+
 print("✓ Worker Celery configurado con auto-discovery")
 
 if __name__ == '__main__':
@@ -0,0 +1,126 @@
+"""
+Métricas del worker de Celery en formato Prometheus
+
+Cada proceso del pool registra en memoria los resultados, reintentos,
+duración y tiempo en cola de sus tareas (desde las señales de
+celery_app.task_events) y los vuelca a Redis periódicamente. El proceso
+principal del worker expone el agregado de todos los procesos, más la
+profundidad de las colas y de la DLQ, en http://<worker>:WORKER_METRICS_PORT/metrics.
+
+Las métricas viven en WORKER_REGISTRY y no en el registro compartido: los
+servicios Flask importan celery_app y su GET /metrics no debe exponer
+familias celery_* vacías ni consultar Redis por la profundidad de las colas.
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import redis
+
+from shared.metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY, MetricsRegistry, render_registry
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9808"))
+WORKER_QUEUES = ("celery", "logistica", "monitor")
+DLQ_TASKS = ("logistica.procesar_entrega",)
+
+_broker = None
+
+
+def _broker_redis():
+    global _broker
+    if _broker is None:
+        _broker = redis.Redis.from_url(os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0"))
+    return _broker
+
+
+def _queue_depths():
+    client = _broker_redis()
+    pipe = client.pipeline(transaction=False)
+    for queue in WORKER_QUEUES:
+        pipe.llen(queue)
+    return {(queue,): depth for queue, depth in zip(WORKER_QUEUES, pipe.execute())}
+
+
+def _dead_letter_depths():
+    from celery_app.dead_letter import dead_letter_count
+
+    return {(task,): dead_letter_count(task) for task in DLQ_TASKS}
+
+
+WORKER_REGISTRY = MetricsRegistry()
+
+TASKS_TOTAL = WORKER_REGISTRY.counter(
+    "celery_tasks_total", "Ejecuciones de tareas por estado final", labelnames=("task", "state")
+)
+TASK_RETRIES = WORKER_REGISTRY.counter(
+    "celery_task_retries_total", "Reintentos programados por tarea", labelnames=("task",)
+)
+TASK_DURATION = WORKER_REGISTRY.histogram(
+    "celery_task_duration_ms", "Duración de ejecución de las tareas (ms)", labelnames=("task",)
+)
+TASK_QUEUE_WAIT = WORKER_REGISTRY.histogram(
+    "celery_task_queue_wait_ms",
+    "Tiempo en cola desde el envío (o el ETA del reintento) hasta la ejecución (ms)",
+    buckets=(1, 5, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 300000),
+    labelnames=("task",),
+)
+QUEUE_DEPTH = WORKER_REGISTRY.gauge(
+    "celery_queue_depth", "Mensajes pendientes por cola del broker", labelnames=("queue",),
+    callback=_queue_depths,
+)
+DEAD_LETTER_DEPTH = WORKER_REGISTRY.gauge(
+    "celery_dead_letter_depth", "Entradas pendientes en la dead-letter queue", labelnames=("task",),
+    callback=_dead_letter_depths,
+)
+
+
+def record_task(task_name, state, duration_ms=None, queue_wait_ms=None):
+    """Registra una ejecución terminada (llamado desde task_postrun)"""
+    TASKS_TOTAL.inc(task_name, state or "UNKNOWN")
+    if state == "RETRY":
+        TASK_RETRIES.inc(task_name)
+    if duration_ms is not None:
+        TASK_DURATION.observe(duration_ms, task_name)
+    if queue_wait_ms is not None:
+        TASK_QUEUE_WAIT.observe(queue_wait_ms, task_name)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        try:
+            # Métricas de tareas más las compartidas que vuelca el worker (ej: etapas)
+            body = (
+                render_registry(WORKER_REGISTRY, source="redis")
+                + render_registry(REGISTRY, source="redis")
+            ).encode("utf-8")
+            status = 200
+        except Exception as e:
+            body = f"# error: {e}\n".encode("utf-8")
+            status = 503
+        self.send_response(status)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Sin una línea de log por cada scrape
+        pass
+
+
+def start_metrics_server(port=WORKER_METRICS_PORT):
+    """Inicia el servidor de /metrics en un hilo daemon del proceso principal"""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="worker-metrics", daemon=True)
+    thread.start()
+    logger.info(f"📈 Métricas del worker en :{port}/metrics")
+    return server
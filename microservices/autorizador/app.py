@@ -8,8 +8,8 @@ sys.path.insert(0, '/app')
 from flask_jwt_extended import JWTManager
 # Importar configuración compartida
 from shared import create_app, add_health_check
-from .modelos import db
-from .vistas import VistaSignUp, VistaLogIn, VistaSignatureGen, VistaSignatureVal
+from .modelos import db, migrar_esquema
+from .vistas import VistaSignUp, VistaLogIn, VistaSignatureGen, VistaSignatureVal, VistaSignaturesVal
 
 
 
@@ -20,6 +20,7 @@ app = create_app(service_name='autorizador')
 with app.app_context():
     db.init_app(app)
     db.create_all()
+    migrar_esquema()
 
 # Configurar API REST
 api = Api(app)
@@ -28,6 +29,7 @@ api.add_resource(VistaSignUp, '/signup')
 api.add_resource(VistaLogIn, '/login')
 api.add_resource(VistaSignatureGen, '/sign-data')
 api.add_resource(VistaSignatureVal, '/validate-signature')
+api.add_resource(VistaSignaturesVal, '/validate-signatures')
 
 # Configurar JWT
 jwt = JWTManager(app)
@@ -1,17 +1,35 @@
 from flask_sqlalchemy import SQLAlchemy
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
 from marshmallow import fields
+from sqlalchemy.exc import IntegrityError, OperationalError
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 db = SQLAlchemy()
 
     
 class Usuario(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    nombre = db.Column(db.String(50))
+    nombre = db.Column(db.String(50), unique=True, index=True)
     contrasena = db.Column(db.String(300))
     roles = db.Column(db.String(200))  # Roles separados por comas
 
 
+def migrar_esquema():
+    """Crea en tablas existentes los índices nuevos (create_all no altera tablas)"""
+    for index in Usuario.__table__.indexes:
+        try:
+            with db.engine.begin() as conn:
+                index.create(conn, checkfirst=True)
+        except IntegrityError as e:
+            logger.warning(f"No se pudo crear el índice {index.name}, hay nombres duplicados: {e}")
+        except OperationalError:
+            # Otro proceso creó el índice entre el checkfirst y el CREATE INDEX
+            pass
+
+
 class UsuarioSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = Usuario
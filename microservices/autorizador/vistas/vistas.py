@@ -6,12 +6,14 @@ from scripts.utils import (
     hash_password,
     sign_data,
     validate_signature,
+    validate_signatures,
 )
 from ..modelos import db, Usuario, UsuarioSchema
 from flask_restful import Resource
 from sqlalchemy.exc import IntegrityError
 from flask_jwt_extended import get_jwt, jwt_required, create_access_token
 from datetime import datetime
+import os
 import random
 import logging
 
@@ -60,7 +62,12 @@ class VistaSignUp(Resource):
             roles="usuario",  # Asignar rol por defecto
         )
         db.session.add(nuevo_usuario)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Registro concurrente con el mismo nombre (índice único)
+            db.session.rollback()
+            return {"mensaje": "El nombre de usuario ya existe"}, 400
 
         token_de_acceso = create_access_token(
             identity={
@@ -130,3 +137,51 @@ class VistaSignatureVal(Resource):
             "timestamp": datetime.now().isoformat(),
             "firma_valida": es_valida,
         }, 200
+
+
+class VistaSignaturesVal(Resource):
+    """
+    Endpoint para validar un lote de firmas digitales en una sola petición
+    """
+
+    @api_protect({"jwt_required": False, "api_key_required": False})
+    def post(self):
+        data = request.get_json()
+        if not data:
+            return {"error": "Body JSON requerido"}, 400
+
+        items = data.get("items") if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return {"error": "items debe ser una lista no vacía de {payload, firma}"}, 400
+
+        max_items = int(os.getenv("SIGNATURE_BATCH_MAX", "1000"))
+        if len(items) > max_items:
+            return {"error": f"Máximo {max_items} firmas por petición"}, 413
+
+        resultados = [None] * len(items)
+        validables = []
+        for index, item in enumerate(items):
+            payload = item.get("payload") if isinstance(item, dict) else None
+            firma = item.get("firma") if isinstance(item, dict) else None
+            if not payload:
+                resultados[index] = {"index": index, "firma_valida": False, "error": "payload es requerido"}
+            elif not firma:
+                resultados[index] = {"index": index, "firma_valida": False, "error": "firma es requerida"}
+            elif not isinstance(firma, str):
+                resultados[index] = {"index": index, "firma_valida": False, "error": "firma debe ser un string"}
+            else:
+                validables.append((index, payload, firma))
+
+        validaciones = validate_signatures(
+            secret_key=current_app.config['PRIVATE_KEY'],
+            items=[(payload, firma) for _, payload, firma in validables],
+        )
+        for (index, _, _), es_valida in zip(validables, validaciones):
+            resultados[index] = {"index": index, "firma_valida": es_valida}
+
+        return {
+            "resultados": resultados,
+            "total": len(resultados),
+            "validas": sum(1 for r in resultados if r["firma_valida"]),
+            "timestamp": datetime.now().isoformat(),
+        }, 200
@@ -1,5 +1,14 @@
-from typing import Literal, Optional, Tuple
+from typing import Literal, Optional, Tuple, Union
 import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+
+from shared.log_schema import REQUEST_ID_HEADER, current_request_id
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -10,45 +19,200 @@ MS_CALLERS_MAP = {
     "logistica-inventario": "http://m-logistica-inventario:5002",
 }
 
+# Configuración del pool de conexiones (por microservicio)
+MS_POOL_SIZE = int(os.getenv("MS_POOL_SIZE", "20"))
+MS_POOL_ACQUIRE_TIMEOUT = float(os.getenv("MS_POOL_ACQUIRE_TIMEOUT", "5"))
+MS_CONNECT_TIMEOUT = float(os.getenv("MS_CONNECT_TIMEOUT", "2"))
+MS_READ_TIMEOUT = float(os.getenv("MS_READ_TIMEOUT", "10"))
+
+
+class PoolSaturatedError(RequestException):
+    """No se obtuvo una conexión del pool dentro de MS_POOL_ACQUIRE_TIMEOUT"""
+
+
+class ServicePool:
+    """
+    Sesión HTTP keep-alive con pool de conexiones propio para un microservicio.
+    Lleva métricas de uso para detectar saturación del pool.
+
+    Como máximo pool_size peticiones en vuelo; las demás esperan un cupo
+    hasta acquire_timeout segundos y luego fallan con PoolSaturatedError
+    (el adapter de urllib3 no bloquea, el límite lo pone el semáforo).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        pool_size: int = MS_POOL_SIZE,
+        acquire_timeout: float = MS_POOL_ACQUIRE_TIMEOUT,
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.acquire_timeout = acquire_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=False,
+            max_retries=0,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_requests = 0
+        self.total_errors = 0
+        self.saturation_events = 0
+        self.acquire_timeouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Ejecuta la petición sobre la sesión compartida registrando métricas"""
+        if not self._slots.acquire(blocking=False):
+            # Todas las conexiones están ocupadas: espera acotada por un cupo
+            started = time.perf_counter()
+            acquired = self._slots.acquire(timeout=self.acquire_timeout)
+            waited_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.saturation_events += 1
+                self.total_wait_ms += waited_ms
+                self.max_wait_ms = max(self.max_wait_ms, waited_ms)
+                if not acquired:
+                    self.acquire_timeouts += 1
+                    self.total_errors += 1
+            if not acquired:
+                raise PoolSaturatedError(
+                    f"Pool de {self.name} saturado: sin conexión libre tras {self.acquire_timeout}s"
+                )
+
+        with self._lock:
+            self.in_flight += 1
+            self.total_requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return self.session.request(method, url, **kwargs)
+        except RequestException:
+            with self._lock:
+                self.total_errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "service": self.name,
+                "base_url": self.base_url,
+                "pool_size": self.pool_size,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "total_requests": self.total_requests,
+                "total_errors": self.total_errors,
+                "saturation_events": self.saturation_events,
+                "acquire_timeouts": self.acquire_timeouts,
+                "acquire_timeout_s": self.acquire_timeout,
+                "max_wait_ms": round(self.max_wait_ms, 3),
+                "total_wait_ms": round(self.total_wait_ms, 3),
+            }
+
+    def close(self):
+        self.session.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name: str) -> Optional[ServicePool]:
+    """Obtiene (o crea de forma perezosa) el pool del microservicio indicado"""
+    pool = _pools.get(name)
+    if pool:
+        return pool
+
+    base_url = MS_CALLERS_MAP.get(name)
+    if not base_url:
+        return None
+
+    with _pools_lock:
+        pool = _pools.get(name)
+        if not pool:
+            pool = ServicePool(name, base_url)
+            _pools[name] = pool
+            logger.info(f"Pool HTTP creado para {name} (tamaño {pool.pool_size})")
+    return pool
+
+
+def get_pool_stats() -> dict:
+    """Métricas de todos los pools creados en este proceso"""
+    return {name: pool.stats() for name, pool in list(_pools.items())}
+
+
+def close_pools():
+    """Cierra todas las conexiones abiertas (útil al apagar el proceso)"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
 
 def call_ms(
-    name: Literal["autorizador", "monitor", "logistica-inventarios"],
+    name: Literal["autorizador", "monitor", "logistica-inventario"],
     resource,
     method: Literal["get", "post", "put", "delete"] = "get",
     data: 'Optional[dict]' = None,
     params: 'Optional[dict]' = None,
     headers: 'Optional[dict]' = None,
+    timeout: 'Optional[Union[float, Tuple[float, float]]]' = None,
 ) -> Tuple[dict, int]:
-    """Llama a otro microservicio y maneja errores comunes"""
-    import requests
-    from requests.exceptions import RequestException
-
-    base_url = MS_CALLERS_MAP.get(name)
-    if not base_url:
+    """Llama a otro microservicio reutilizando conexiones y maneja errores comunes"""
+    pool = get_pool(name)
+    if not pool:
         return {"error": f"Microservicio no encontrado: {name}"}, 404
 
-    url = f"{base_url}{resource}"
+    url = f"{pool.base_url}{resource}"
     logger.info(f"Llamando a {url} con método {method.upper()}")
-    
+
+    if method.lower() not in ("get", "post", "put", "delete"):
+        logger.warning(f"Método HTTP no soportado: {method}")
+        return {"error": f"Método HTTP no soportado: {method}"}, 400
+
+    if timeout is None:
+        timeout = (MS_CONNECT_TIMEOUT, MS_READ_TIMEOUT)
+
+    # Propagar el request_id para correlacionar los logs entre servicios
+    request_id = current_request_id()
+    if request_id:
+        headers = {**(headers or {}), REQUEST_ID_HEADER: request_id}
+
     try:
         if method.lower() == "get":
-            response = requests.get(url, params=params, headers=headers)
+            response = pool.request("GET", url, params=params, headers=headers, timeout=timeout)
         elif method.lower() == "post":
-            response = requests.post(url, json=data, headers=headers)
+            response = pool.request("POST", url, json=data, headers=headers, timeout=timeout)
         elif method.lower() == "put":
-            response = requests.put(url, json=data, headers=headers)
-        elif method.lower() == "delete":
-            response = requests.delete(url, headers=headers)
+            response = pool.request("PUT", url, json=data, headers=headers, timeout=timeout)
         else:
-            logger.warning(f"Método HTTP no soportado: {method}")
-            return {"error": f"Método HTTP no soportado: {method}"}, 400
-        
+            response = pool.request("DELETE", url, headers=headers, timeout=timeout)
+
         logger.info(f"Respuesta recibida: {response.status_code}")
-        
-        logger.info(f"Cuerpo de la respuesta: {response.json()}")
-        
+
+        body = response.json()
+        logger.debug(f"Cuerpo de la respuesta: {body}")
+
         response.raise_for_status()  # Lanza un error para códigos de estado 4xx/5xx
-        return {"data": response.json() }, response.status_code
+        return {"data": body}, response.status_code
+    except PoolSaturatedError as e:
+        logger.error(f"Error llamando al microservicio {name}: {e}")
+        return {"error": str(e)}, 503
     except RequestException as e:
         logger.error(f"Error llamando al microservicio {name}: {e}")
         return {"error": str(e)}, 500
@@ -0,0 +1,97 @@
+"""
+Variante asíncrona de call_ms con API de fan-out concurrente.
+
+Las llamadas se ejecutan sobre los pools keep-alive de m_callers en un
+executor, de modo que el event loop no bloquea y las conexiones se reutilizan
+entre peticiones aunque cada request Flask cree su propio loop.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional, Tuple
+
+from microservices.callers.m_callers import MS_CONNECT_TIMEOUT, MS_READ_TIMEOUT, call_ms
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MS_ASYNC_WORKERS = int(os.getenv("MS_ASYNC_WORKERS", "32"))
+
+_executor = ThreadPoolExecutor(
+    max_workers=MS_ASYNC_WORKERS, thread_name_prefix="call_ms"
+)
+
+
+async def async_call_ms(
+    name,
+    resource,
+    method="get",
+    data: Optional[dict] = None,
+    params: Optional[dict] = None,
+    headers: Optional[dict] = None,
+    timeout: Optional[float] = None,
+) -> Tuple[dict, int]:
+    """
+    Contraparte asíncrona de call_ms.
+
+    Args:
+        timeout: Tiempo máximo total de la llamada en segundos. También se usa
+            como timeout de lectura HTTP para que el hilo no quede ocupado.
+    """
+    loop = asyncio.get_running_loop()
+    http_timeout = (MS_CONNECT_TIMEOUT, timeout) if timeout else (MS_CONNECT_TIMEOUT, MS_READ_TIMEOUT)
+    func = partial(
+        call_ms,
+        name,
+        resource,
+        method=method,
+        data=data,
+        params=params,
+        headers=headers,
+        timeout=http_timeout,
+    )
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(_executor, func), timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"Timeout llamando al microservicio {name}{resource} ({timeout}s)")
+        return {"error": f"Timeout tras {timeout}s"}, 504
+
+
+async def call_many(calls: List[dict], timeout: Optional[float] = None) -> List[Tuple[dict, int]]:
+    """
+    Envía varias llamadas a microservicios en paralelo y devuelve los resultados
+    en el mismo orden.
+
+    Args:
+        calls: Lista de dicts con los argumentos de call_ms
+            (name, resource, method, data, params, headers y opcionalmente timeout)
+        timeout: Timeout por defecto para las llamadas que no definan el suyo
+
+    Returns:
+        Lista de tuplas (respuesta, status_code)
+    """
+    tasks = [
+        async_call_ms(
+            call["name"],
+            call["resource"],
+            method=call.get("method", "get"),
+            data=call.get("data"),
+            params=call.get("params"),
+            headers=call.get("headers"),
+            timeout=call.get("timeout", timeout),
+        )
+        for call in calls
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    return [
+        ({"error": str(result)}, 500) if isinstance(result, BaseException) else result
+        for result in results
+    ]
+
+
+def call_many_sync(calls: List[dict], timeout: Optional[float] = None) -> List[Tuple[dict, int]]:
+    """Ejecuta call_many desde código síncrono (ej: vistas Flask)"""
+    return asyncio.run(call_many(calls, timeout=timeout))
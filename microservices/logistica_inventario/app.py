@@ -1,5 +1,6 @@
 import sys
 import os
+import logging
 # Agregar el directorio raíz al PYTHONPATH
 sys.path.insert(0, '/app')
 
@@ -8,14 +9,32 @@ from flask_jwt_extended import JWTManager
 
 # Importar configuración compartida
 from shared import create_app, add_health_check
+from microservices.callers.m_callers import get_pool_stats
+from shared.metrics import load_from_redis, merge_series, summarize
+from .metricas import ETAPAS_CONFIRMACION
 # Removed setup_cors - CORS is handled by nginx API Gateway
 
 # Importar modelos y vistas locales
-from .modelos import db
-from .vistas import VistaEntregas, VistaEntrega, VistaTareas, VistaTareaDetail,  VistaConfirmarEntrega
+from .modelos import db, migrar_esquema
+from .vistas import VistaEntregas, VistaEntregasBulk, VistaEntrega, VistaTareas, VistaTareaDetail,  VistaConfirmarEntrega, VistaDeadLetters
+
+def _load_signature_key():
+    """Carga la llave compartida con el autorizador para verificar firmas localmente"""
+    key_path = os.getenv('SIGNATURE_KEY_PATH', os.getenv('PRIVATE_KEY_PATH', './private_key.pem'))
+    try:
+        with open(key_path, 'r') as key_file:
+            return key_file.read()
+    except OSError:
+        return None
+
 
 # Crear la aplicación usando la configuración compartida
-app = create_app(service_name='logistica_inventario')
+app = create_app(service_name='logistica_inventario', config_overrides={
+    # 'local': verifica la firma en proceso, 'remote': llama al autorizador
+    'SIGNATURE_VERIFICATION_MODE': os.getenv('SIGNATURE_VERIFICATION_MODE', 'local'),
+    'SIGNATURE_REMOTE_FALLBACK': os.getenv('SIGNATURE_REMOTE_FALLBACK', '1') == '1',
+    'SIGNATURE_KEY': _load_signature_key(),
+})
 
 # CORS is handled by nginx API Gateway - no need to setup here
 
@@ -23,14 +42,17 @@ app = create_app(service_name='logistica_inventario')
 with app.app_context():
     db.init_app(app)
     db.create_all()
+    migrar_esquema()
 
 # Configurar API REST
 api = Api(app)
 api.add_resource(VistaEntregas, '/entregas')
+api.add_resource(VistaEntregasBulk, '/entregas/bulk')
 api.add_resource(VistaEntrega, '/entrega/<int:id_entrega>')
 api.add_resource(VistaConfirmarEntrega, '/entrega/<int:id_entrega>/confirmar')
 api.add_resource(VistaTareaDetail, '/tarea', '/tarea/<string:task_id>')
 api.add_resource(VistaTareas, '/tareas')
+api.add_resource(VistaDeadLetters, '/entregas/dead-letter')
 
 # Configurar JWT
 jwt = JWTManager(app)
@@ -38,5 +60,26 @@ jwt = JWTManager(app)
 # Agregar health check
 add_health_check(app, 'logistica_inventario')
 
+
+@app.route('/metrics/callers')
+def callers_metrics():
+    """Métricas de los pools HTTP hacia otros microservicios"""
+    return {"pools": get_pool_stats()}
+
+
+@app.route('/metrics/etapas')
+def etapas_metrics():
+    """Latencia por etapa de la confirmación de entregas (servicio + worker vía Redis)"""
+    local = ETAPAS_CONFIRMACION.snapshot()
+    try:
+        worker = load_from_redis(ETAPAS_CONFIRMACION)
+    except Exception as e:
+        worker = {}
+        logging.getLogger(__name__).warning(f"Métricas del worker no disponibles: {e}")
+    return {
+        "histograma": ETAPAS_CONFIRMACION.name,
+        "etapas": summarize(ETAPAS_CONFIRMACION, merge_series(local, worker)),
+    }
+
 # Nota: Este microservicio usa el task_dispatcher para enviar tareas
 # NO importa directamente las definiciones de tareas para evitar dependencias circulares
\ No newline at end of file
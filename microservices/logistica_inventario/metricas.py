@@ -0,0 +1,25 @@
+"""
+Métricas de latencia por etapa de la confirmación de entregas
+
+Etapas en el servicio (VistaConfirmarEntrega -> sync_procesar_entrega):
+    api.validacion, api.claim_check, api.verificar_firma, api.idempotencia,
+    api.despacho, api.total
+Etapas en el worker (procesar_entrega_impl):
+    worker.cola, worker.verificar_mensaje, worker.idempotencia,
+    worker.procesamiento, worker.claim_check, worker.cifrado,
+    worker.transicion, worker.total
+"""
+
+from shared.metrics import histogram
+
+ETAPAS_CONFIRMACION = histogram(
+    "logistica_confirmacion_etapa_ms",
+    "Latencia por etapa de la confirmación de entregas (ms)",
+    buckets=(1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2000, 5000, 10000, 30000, 60000),
+    labelnames=("etapa",),
+)
+
+
+def etapa(nombre):
+    """Context manager que registra la duración de la etapa"""
+    return ETAPAS_CONFIRMACION.time(nombre)
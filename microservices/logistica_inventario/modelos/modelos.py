@@ -1,19 +1,91 @@
 from flask_sqlalchemy import SQLAlchemy
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
 from marshmallow import fields
+from sqlalchemy import inspect, or_, select, text, update
+from sqlalchemy.exc import OperationalError
 
 db = SQLAlchemy()
 
 class Entrega(db.Model):
     id = db.Column(db.Integer, primary_key = True)
     direccion = db.Column(db.String(128))
-    pedido_id = db.Column(db.String(64))
-    estado = db.Column(db.String(64))
+    pedido_id = db.Column(db.String(64), index=True)
+    estado = db.Column(db.String(64), index=True)
     firma_recibe = db.Column(db.Text, nullable=True)
     nombre_recibe = db.Column(db.String(128), nullable=True)
     integridad_firma = db.Column(db.String(1024), nullable=True)
-    fecha_entrega = db.Column(db.DateTime, default=None, nullable=True)
+    fecha_entrega = db.Column(db.DateTime, default=None, nullable=True, index=True)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    # Estados desde los que no se permite transicionar
+    ESTADOS_FINALES = ("ENTREGADA",)
+
+    @classmethod
+    def transicion_stmt(cls, entrega_id, nuevo_estado, version=None, **valores):
+        """
+        UPDATE condicional de estado: solo aplica si la entrega no está en un estado
+        final y, si se indica version, si la versión coincide (concurrencia optimista).
+        Incrementa version en cada transición.
+
+        procesar_entrega pasa version en los reintentos (la leída con estado_actual);
+        en la primera ejecución la guarda es solo el estado no final.
+        """
+        condiciones = [
+            cls.id == entrega_id,
+            or_(cls.estado.is_(None), cls.estado.notin_(cls.ESTADOS_FINALES)),
+        ]
+        if version is not None:
+            condiciones.append(cls.version == version)
+
+        return (
+            update(cls)
+            .where(*condiciones)
+            .values(estado=nuevo_estado, version=cls.version + 1, **valores)
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    def transicionar(cls, entrega_id, nuevo_estado, version=None, **valores):
+        """
+        Cambia el estado de una entrega con un único UPDATE condicional, sin cargarla.
+
+        Returns:
+            True si la transición se aplicó, False si otra escritura la ganó,
+            la entrega ya estaba en un estado final o no existe
+        """
+        resultado = db.session.execute(
+            cls.transicion_stmt(entrega_id, nuevo_estado, version, **valores)
+        )
+        db.session.commit()
+        return resultado.rowcount == 1
+
+    @classmethod
+    def estado_actual(cls, entrega_id):
+        """Lee solo el estado y la versión de la entrega (None si no existe)"""
+        return db.session.execute(
+            select(cls.estado, cls.version).where(cls.id == entrega_id)
+        ).first()
     
+def migrar_esquema():
+    """Agrega a tablas existentes las columnas e índices nuevos (create_all no altera tablas)"""
+    columnas = {c["name"] for c in inspect(db.engine).get_columns("entrega")}
+    if "version" not in columnas:
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text("ALTER TABLE entrega ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+        except OperationalError:
+            # Otro proceso (web o worker) ya agregó la columna
+            pass
+
+    for index in Entrega.__table__.indexes:
+        try:
+            with db.engine.begin() as conn:
+                index.create(conn, checkfirst=True)
+        except OperationalError:
+            # Otro proceso creó el índice entre el checkfirst y el CREATE INDEX
+            pass
+
+
 class EntregaSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = Entrega
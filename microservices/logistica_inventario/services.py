@@ -1,17 +1,88 @@
 from datetime import datetime
 import os
 import random
+from flask import current_app
+from celery_app.claim_check import (
+    CONFIRMACION_CLAIM_FIELDS,
+    ClaimCheckError,
+    ClaimCheckUnavailableError,
+    check_in,
+    check_out,
+)
+from celery_app import idempotency
 from celery_app.dispatcher import LogisticaTasks
+from celery_app.idempotency import idempotency_key
 from microservices.callers.m_callers import call_ms
+from microservices.logistica_inventario.metricas import etapa
+from scripts.utils import validate_signature
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def sync_procesar_entrega(entrega_id, retry_count=0, confirmacion_info=None):
+# Campos de confirmacion_info que pueden viajar como referencia al blob store
+CLAIM_CHECK_FIELDS = CONFIRMACION_CLAIM_FIELDS
+
+# Dueño provisional de la llave de idempotencia mientras se despacha la tarea
+DESPACHO_EN_CURSO = "dispatching"
+
+def _verificar_firma_remota(payload, firma):
+    """Valida la firma llamando al autorizador"""
+    (response, status_code) = call_ms(
+        "autorizador",
+        "/validate-signature",
+        method="post",
+        data={"payload": payload, "firma": firma},
+        headers={"Content-Type": "application/json", "i-api-key": os.getenv("API_KEY")},
+    )
+    return response.get("data", {}).get("firma_valida") if status_code == 200 else False
+
+
+def verificar_firma(payload, firma):
     """
-    Procesa la entrega de manera síncrona.
+    Verifica la firma del payload según SIGNATURE_VERIFICATION_MODE.
+
+    En modo 'local' se valida en proceso con la llave compartida con el autorizador;
+    si la llave no está cargada solo se llama al autorizador cuando
+    SIGNATURE_REMOTE_FALLBACK está habilitado.
+
+    Returns:
+        True/False según la validez de la firma, o None si no es posible verificarla
     """
+    mode = current_app.config.get("SIGNATURE_VERIFICATION_MODE", "local")
+
+    if mode == "remote":
+        return _verificar_firma_remota(payload, firma)
+
+    secret_key = current_app.config.get("SIGNATURE_KEY")
+    if secret_key:
+        if not firma:
+            return False
+        return validate_signature(secret_key=secret_key, data=payload, signature=firma)
+
+    if current_app.config.get("SIGNATURE_REMOTE_FALLBACK", False):
+        logger.warning("SIGNATURE_KEY no configurada, validando firma con el autorizador")
+        return _verificar_firma_remota(payload, firma)
+
+    logger.error("SIGNATURE_KEY no configurada y fallback remoto deshabilitado")
+    return None
+
+
+def _despachar_entrega(entrega_id, status, retry_count, confirmacion_info, idem_key):
+    """Despacha procesar_entrega y registra la tarea como dueña de la llave de idempotencia"""
+    with etapa("api.despacho"):
+        task_result = LogisticaTasks.procesar_entrega(
+            entrega_id, status, retry_count, confirmacion_info
+        )
+    if task_result.get("error"):
+        idempotency.release(idem_key, "dispatch")
+    else:
+        idempotency.set_owner("dispatch", idem_key, task_result["task_id"])
+    return task_result
+
+
+def _validar_confirmacion(entrega_id, confirmacion_info):
+    """Retorna el error (dict, status) de la primera validación que falle, o None"""
     if not entrega_id:
         return {"error": "entrega_id es requerido"}, 400
 
@@ -33,38 +104,83 @@ def sync_procesar_entrega(entrega_id, retry_count=0, confirmacion_info=None):
         return {"error": "pedido_id es requerido en confirmacion_info"}, 400
     if not confirmacion_info.get("entrega_id"):
         return {"error": "entrega_id es requerido en confirmacion_info"}, 400
+    return None
+
+
+@etapa("api.total")
+def sync_procesar_entrega(entrega_id, retry_count=0, confirmacion_info=None):
+    """
+    Procesa la entrega de manera síncrona.
+    """
+    with etapa("api.validacion"):
+        error = _validar_confirmacion(entrega_id, confirmacion_info)
+    if error:
+        return error
+
+    payload = {
+        "direccion": confirmacion_info.get("direccion"),
+        "nombre_recibe": confirmacion_info.get("nombre_recibe"),
+        "firma_recibe": confirmacion_info.get("firma_recibe"),
+        "pedido_id": confirmacion_info.get("pedido_id"),
+        "usuario_id": confirmacion_info.get("usuario_id"),
+        "entrega_id": confirmacion_info.get("entrega_id"),
+    }
+    try:
+        # Re-envíos pueden traer firma_recibe como referencia al blob store
+        with etapa("api.claim_check"):
+            payload = check_out(payload, CLAIM_CHECK_FIELDS)
+    except ClaimCheckUnavailableError as e:
+        logger.error(f"Claim-check no disponible: {e}")
+        return {"error": "Almacén de blobs no disponible"}, 503
+    except ClaimCheckError as e:
+        return {"error": str(e)}, 400
+
+    with etapa("api.verificar_firma"):
+        is_valid = verificar_firma(payload, confirmacion_info.get("firma_payload"))
+    if is_valid is None:
+        return {"error": "Verificación de firma no disponible"}, 503
 
-    (response, status_code) = call_ms(
-        "autorizador",
-        "/validate-signature",
-        method="post",
-        data={
-            "payload": {
-                "direccion": confirmacion_info.get("direccion"),
-                "nombre_recibe": confirmacion_info.get("nombre_recibe"),
-                "firma_recibe": confirmacion_info.get("firma_recibe"),
-                "pedido_id": confirmacion_info.get("pedido_id"),
-                "usuario_id": confirmacion_info.get("usuario_id"),
-                "entrega_id": confirmacion_info.get("entrega_id"),
-            },
-            "firma": confirmacion_info.get("firma_payload"),
-        },
-        headers={"Content-Type": "application/json", "i-api-key": os.getenv("API_KEY")},
-    )
-    
-    is_valid = response.get("data", {}).get("firma_valida") if status_code == 200 else False
-    
     if not is_valid:
         return {"error": "Firma no válida"}, 403
     
+    # Los blobs grandes viajan por el broker como referencia (claim-check)
+    try:
+        with etapa("api.claim_check"):
+            confirmacion_info = check_in(confirmacion_info, CLAIM_CHECK_FIELDS)
+    except Exception as e:
+        logger.warning(f"Claim-check no disponible, enviando payload completo: {e}")
+
+    # Descartar confirmaciones duplicadas antes de despachar
+    with etapa("api.idempotencia"):
+        idem_key = idempotency_key(entrega_id, confirmacion_info)
+        tarea_existente = idempotency.acquire("dispatch", idem_key, DESPACHO_EN_CURSO)
+    if tarea_existente == DESPACHO_EN_CURSO:
+        # Otra petición con la misma confirmación aún no recibe su task_id
+        logger.info(f"Confirmación de entrega {entrega_id} en despacho por otra petición")
+        return {
+            "error": "Confirmación en proceso de despacho, reintente en unos segundos",
+            "entrega_id": entrega_id,
+            "estado": "en_proceso",
+            "timestamp": datetime.utcnow().isoformat(),
+        }, 409
+    if tarea_existente:
+        logger.info(f"Confirmación duplicada para entrega {entrega_id}, tarea {tarea_existente}")
+        return {
+            "message": "Confirmación duplicada, ya fue enviada",
+            "entrega_id": entrega_id,
+            "estado": "duplicada",
+            "task_id": tarea_existente,
+            "timestamp": datetime.utcnow().isoformat(),
+        }, 200
+
     try:
 
         # Para tareas nuevas, aplicar la lógica de falla aleatoria
         if random.random() < 0.5:
             raise Exception("Sistema temporalmente no disponible")
 
-        task_result = LogisticaTasks.procesar_entrega(
-            entrega_id, "ENTREGADA", retry_count, confirmacion_info
+        task_result = _despachar_entrega(
+            entrega_id, "ENTREGADA", retry_count, confirmacion_info, idem_key
         )
 
         return {
@@ -76,8 +192,8 @@ def sync_procesar_entrega(entrega_id, retry_count=0, confirmacion_info=None):
         }, 200
 
     except Exception as e:
-        task_result = LogisticaTasks.procesar_entrega(
-            entrega_id, "PENDING_SYSTEM_CONFIRMATION", retry_count, confirmacion_info
+        task_result = _despachar_entrega(
+            entrega_id, "PENDING_SYSTEM_CONFIRMATION", retry_count, confirmacion_info, idem_key
         )
         return {
             "message": "Tarea enviada",
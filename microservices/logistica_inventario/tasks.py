@@ -6,11 +6,31 @@ from functools import wraps
 import os
 import time
 import random
-import requests
 from datetime import datetime
 from microservices.logistica_inventario.modelos import db, Entrega
 from microservices.logistica_inventario import app
-from scripts.utils import encrypt, required_signed_celery_message, with_app_context
+from microservices.logistica_inventario.services import CLAIM_CHECK_FIELDS
+from sqlalchemy import and_, or_
+from celery.exceptions import Retry
+from celery_app import idempotency
+from celery_app.idempotency import idempotency_key
+from celery_app.claim_check import ClaimCheckError, check_out
+from celery_app.dead_letter import push_dead_letter, replay_dead_letters
+from celery_app.dispatcher import LogisticaTasks
+from celery_app.task_events import queue_wait_ms
+from microservices.logistica_inventario.metricas import ETAPAS_CONFIRMACION, etapa
+from microservices.logistica_inventario.write_buffer import (
+    ENTREGA_GROUP_COMMIT,
+    GROUP_COMMIT_TIMEOUT,
+    get_write_buffer,
+)
+from scripts.utils import (
+    GCM_PREFIX,
+    encrypt_many,
+    reencrypt_many,
+    required_signed_celery_message,
+    with_app_context,
+)
 
 # Solo importar cuando estamos en el contexto del worker
 try:
@@ -23,113 +43,172 @@ except ImportError:
     celery_instance = None
 
 
-def _register_task(func, name):
+def _register_task(func, name, **task_options):
     """Helper para registrar tareas de forma segura"""
     if celery_instance:
-        return celery_instance.task(name=name)(func)
+        return celery_instance.task(name=name, **task_options)(func)
     else:
         # Si no hay celery, devolver la función original
         return func
 
 
-def _retry_task_via_api(
-    entrega_id, current_retry=0, max_retries=3, confirmacion_info=None
-):
+# Configuración de reintentos de procesar_entrega
+ENTREGA_MAX_RETRIES = int(os.getenv("ENTREGA_MAX_RETRIES", "3"))
+ENTREGA_RETRY_BACKOFF = float(os.getenv("ENTREGA_RETRY_BACKOFF", "2"))
+ENTREGA_RETRY_BACKOFF_MAX = float(os.getenv("ENTREGA_RETRY_BACKOFF_MAX", "60"))
+
+
+class SistemaNoDisponibleError(Exception):
+    """El sistema de confirmación no está disponible; la entrega se reintentará"""
+
+
+def _sistema_disponible():
+    """Simula la disponibilidad del sistema de confirmación (misma tasa que en services)"""
+    return random.random() >= 0.5
+
+
+def _retry_countdown(retry_count):
+    """Backoff exponencial con jitter completo, en segundos"""
+    return random.uniform(
+        0, min(ENTREGA_RETRY_BACKOFF_MAX, ENTREGA_RETRY_BACKOFF * (2**retry_count))
+    )
+
+
+def _transicionar(entrega_id, nuevo_estado, **valores):
     """
-    Realiza un retry automático llamando a la API
+    Aplica la transición de estado; con ENTREGA_GROUP_COMMIT la escritura se
+    agrupa con las de otras tareas y se espera al commit del lote.
     """
-    if current_retry >= max_retries:
-        print(
-            f"❌ [LOGISTICA] Máximo de reintentos alcanzado para entrega {entrega_id}"
-        )
+    if not ENTREGA_GROUP_COMMIT:
+        return Entrega.transicionar(entrega_id, nuevo_estado, **valores)
+
+    stmt = Entrega.transicion_stmt(entrega_id, nuevo_estado, **valores)
+    return get_write_buffer(app).execute(stmt, timeout=GROUP_COMMIT_TIMEOUT) == 1
+
+
+def _resultado_sin_transicion(entrega_id, idem_key):
+    """
+    Resultado cuando el UPDATE condicional no aplicó: la entrega no existe, ya
+    es final o su versión cambió desde que el reintento la leyó
+    """
+    actual = Entrega.estado_actual(entrega_id)
+    if not actual:
+        print(f"❌ [LOGISTICA] Entrega {entrega_id} no encontrada")
+        idempotency.release(idem_key, "dispatch", "worker")
         return {
+            "error": "Entrega no encontrada",
             "entrega_id": entrega_id,
-            "status": "FAILED_MAX_RETRIES",
             "timestamp": datetime.now().isoformat(),
-            "retry_count": current_retry,
-            "error": "Excedido máximo de reintentos",
+            "worker": "logistica_worker",
         }
 
-    try:
-        # Esperar un poco antes del reintento
-        time.sleep(random.uniform(0, 0.1) ** current_retry)  # Backoff exponencial
-
+    if actual.estado not in Entrega.ESTADOS_FINALES:
         print(
-            f"🔄 [LOGISTICA] Reintentando entrega {entrega_id} (intento {current_retry + 1}/{max_retries})"
+            f"⚠️ [LOGISTICA] Entrega {entrega_id} modificada por otra escritura "
+            f"(versión {actual.version}), transición omitida"
         )
-
-        # Llamar a la API para reenviar la tarea
-        api_url = "http://m-logistica-inventario:5002/tareas"
-        payload = {
-            "tipo": "procesar_entrega",
+        # No se escribió nada: liberar la llave para permitir reenviar la confirmación
+        idempotency.release(idem_key, "dispatch", "worker")
+        return {
             "entrega_id": entrega_id,
-            "_retry_count": current_retry + 1,
-            "confirmacion_info": confirmacion_info,
+            "status": "CONFLICT",
+            "estado_actual": actual.estado,
+            "version": actual.version,
+            "timestamp": datetime.now().isoformat(),
+            "worker": "logistica_worker",
+            "message": "La entrega cambió durante el procesamiento, reenviar la confirmación",
         }
 
-        response = requests.post(
-            api_url,
-            json=payload,
-            timeout=10,
-            headers={
-                "Content-Type": "application/json",
-                "i-api-key": os.getenv("API_KEY", "secret"),
-            },
-        )
-
-        if response.status_code in [200, 202]:
-            result = response.json()
-            print(f"✅ [LOGISTICA] Reintento enviado para entrega {entrega_id}")
-            return {
-                "entrega_id": entrega_id,
-                "status": "RETRY_SUBMITTED",
-                "timestamp": datetime.now().isoformat(),
-                "retry_count": current_retry + 1,
-                "task_id": result.get("task_id"),
-                "original_response": result,
-            }
-        else:
-            print(f"⚠️ [LOGISTICA] Error en reintento API: {response.status_code}")
-            return _retry_task_via_api(
-                entrega_id,
-                current_retry + 1,
-                max_retries,
-                confirmacion_info=confirmacion_info,
-            )
-
-    except Exception as e:
-        print(f"⚠️ [LOGISTICA] Error en reintento: {str(e)}")
-        return _retry_task_via_api(
-            entrega_id,
-            current_retry + 1,
-            max_retries,
-            confirmacion_info=confirmacion_info,
-        )
+    print(
+        f"⏭️ [LOGISTICA] Entrega {entrega_id} ya está en estado {actual.estado}, transición omitida"
+    )
+    return {
+        "entrega_id": entrega_id,
+        "status": "SKIPPED",
+        "estado_actual": actual.estado,
+        "version": actual.version,
+        "timestamp": datetime.now().isoformat(),
+        "worker": "logistica_worker",
+        "message": "La entrega ya fue finalizada por otra ejecución",
+    }
 
 
 # Implementaciones de las tareas
 @with_app_context(app)
 def procesar_entrega_impl(
-    entrega_id, status, _retry_count=0, confirmacion_info=None, **kwargs
+    self, entrega_id, status, _retry_count=0, confirmacion_info=None, **kwargs
 ):
-    """Procesa una entrega específica con mecanismo de retry automático"""
-    required_signed_celery_message(kwargs=kwargs)
+    """
+    Procesa una entrega específica con mecanismo de retry automático.
+
+    Si el sistema no está disponible la tarea se re-encola con self.retry y un
+    countdown con backoff exponencial y jitter; el worker no queda bloqueado y
+    los argumentos firmados del mensaje se conservan.
+    """
+    espera_cola = queue_wait_ms(self.request, time.time())
+    if espera_cola is not None:
+        ETAPAS_CONFIRMACION.observe(espera_cola, "worker.cola")
+
+    with etapa("worker.verificar_mensaje"):
+        required_signed_celery_message(
+            kwargs,
+            "logistica.procesar_entrega",
+            [entrega_id, status, _retry_count, confirmacion_info],
+        )
+    retry_count = _retry_count + self.request.retries
     print(
-        f"🚚 [LOGISTICA] Procesando entrega {entrega_id} con estado {status} (retry: {_retry_count})"
+        f"🚚 [LOGISTICA] Procesando entrega {entrega_id} con estado {status} (retry: {retry_count})"
     )
-    time.sleep(random.uniform(0, 1))  # Simular trabajo
-
-    entrega = db.session.query(Entrega).get(entrega_id)
 
-    if not entrega:
-        print(f"❌ [LOGISTICA] Entrega {entrega_id} no encontrada")
+    # Descartar ejecuciones duplicadas de la misma confirmación (los reintentos comparten task id)
+    with etapa("worker.idempotencia"):
+        idem_key = idempotency_key(entrega_id, confirmacion_info)
+        tarea_existente = idempotency.acquire("worker", idem_key, self.request.id or "local")
+    if tarea_existente:
+        print(f"⏭️ [LOGISTICA] Entrega {entrega_id} duplicada, ya procesada por {tarea_existente}")
         return {
-            "error": "Entrega no encontrada",
             "entrega_id": entrega_id,
+            "status": "DUPLICATE",
+            "duplicate_of": tarea_existente,
             "timestamp": datetime.now().isoformat(),
             "worker": "logistica_worker",
         }
 
+    try:
+        return _procesar_confirmacion(
+            self, entrega_id, status, _retry_count, retry_count, confirmacion_info, idem_key
+        )
+    except Retry:
+        # Los reintentos conservan la llave: comparten el task id
+        raise
+    except Exception:
+        # Un fallo inesperado (cifrado, transición, commit) no debe dejar la llave
+        # reservada durante IDEMPOTENCY_WINDOW para una entrega que no se escribió
+        idempotency.release(idem_key, "dispatch", "worker")
+        raise
+
+
+def _procesar_confirmacion(
+    task, entrega_id, status, _retry_count, retry_count, confirmacion_info, idem_key
+):
+    """
+    Procesa la confirmación una vez reservada la llave de idempotencia del worker.
+
+    En la primera ejecución la transición final solo se protege con el estado
+    (no debe ser final). En un reintento se leen estado y versión antes de
+    procesar y la transición final se condiciona a esa versión: si otra
+    escritura tocó la entrega mientras tanto, no se sobrescribe.
+    """
+    version_leida = None
+    if task.request.retries > 0:
+        actual = Entrega.estado_actual(entrega_id)
+        if not actual or actual.estado in Entrega.ESTADOS_FINALES:
+            return _resultado_sin_transicion(entrega_id, idem_key)
+        version_leida = actual.version
+
+    with etapa("worker.procesamiento"):
+        time.sleep(random.uniform(0, 1))  # Simular trabajo
+
     if not confirmacion_info:
         print(
             f"❌ [LOGISTICA] confirmacion_info es requerido para entrega {entrega_id}"
@@ -141,56 +220,102 @@ def procesar_entrega_impl(
             "worker": "logistica_worker",
         }
 
-    if status == "PENDING_SYSTEM_CONFIRMATION":
+    # En un reintento se vuelve a comprobar la disponibilidad del sistema
+    if status == "PENDING_SYSTEM_CONFIRMATION" and (
+        task.request.retries == 0 or not _sistema_disponible()
+    ):
         print(f"⚠️ [LOGISTICA] Sistema no disponible para entrega {entrega_id}")
 
-        entrega.estado = "PENDING_SYSTEM_CONFIRMATION"
-        db.session.commit()
+        # En reintentos el estado ya se verificó al leer version_leida
+        if task.request.retries == 0 and not _transicionar(
+            entrega_id, "PENDING_SYSTEM_CONFIRMATION"
+        ):
+            return _resultado_sin_transicion(entrega_id, idem_key)
+
+        if retry_count >= ENTREGA_MAX_RETRIES:
+            print(
+                f"❌ [LOGISTICA] Máximo de reintentos alcanzado para entrega {entrega_id}"
+            )
+            # Liberar la llave para que el replay de la DLQ pueda re-procesarla
+            idempotency.release(idem_key, "dispatch", "worker")
+            # La DLQ no expira: guardar los blobs resueltos y no la referencia con TTL
+            try:
+                info_dead_letter = check_out(confirmacion_info, CLAIM_CHECK_FIELDS)
+            except ClaimCheckError as e:
+                print(f"⚠️ [LOGISTICA] Entrega {entrega_id} va a la DLQ con el claim-check sin resolver: {e}")
+                info_dead_letter = confirmacion_info
+            push_dead_letter(
+                "logistica.procesar_entrega",
+                [entrega_id, status, _retry_count, info_dead_letter],
+                task_id=task.request.id,
+                error="Excedido máximo de reintentos",
+            )
+            return {
+                "entrega_id": entrega_id,
+                "status": "FAILED_MAX_RETRIES",
+                "timestamp": datetime.now().isoformat(),
+                "worker": "logistica_worker",
+                "retry_count": retry_count,
+                "error": "Excedido máximo de reintentos",
+                "dead_letter": True,
+            }
 
-        result = {
+        countdown = _retry_countdown(retry_count)
+        print(
+            f"🔄 [LOGISTICA] Reintentando entrega {entrega_id} en {countdown:.2f}s "
+            f"(intento {retry_count + 1}/{ENTREGA_MAX_RETRIES})"
+        )
+        raise task.retry(
+            countdown=countdown,
+            max_retries=None,  # el límite se controla con ENTREGA_MAX_RETRIES
+            exc=SistemaNoDisponibleError(
+                f"Sistema temporalmente no disponible para entrega {entrega_id}, "
+                f"reintento {retry_count + 1}/{ENTREGA_MAX_RETRIES} en {countdown:.2f}s"
+            ),
+        )
+
+    try:
+        with etapa("worker.claim_check"):
+            confirmacion_info = check_out(confirmacion_info, CLAIM_CHECK_FIELDS)
+    except ClaimCheckError as e:
+        print(f"❌ [LOGISTICA] No se pudo resolver el claim-check de la entrega {entrega_id}: {e}")
+        idempotency.release(idem_key, "dispatch", "worker")
+        return {
+            "error": str(e),
             "entrega_id": entrega_id,
-            "status": "PENDING_SYSTEM_CONFIRMATION",
             "timestamp": datetime.now().isoformat(),
             "worker": "logistica_worker",
-            "retry_count": _retry_count,
-            "message": "Sistema temporalmente no disponible, reintentando automáticamente...",
         }
 
-        # Realizar retry automático en background
-        retry_result = _retry_task_via_api(
-            entrega_id, _retry_count, confirmacion_info=confirmacion_info
+    # Procesamiento exitoso: un único UPDATE condicional, sin cargar la entrega
+    with etapa("worker.cifrado"):
+        (direccion, nombre_recibe, firma_recibe) = encrypt_many(
+            [
+                confirmacion_info.get("direccion", None) or None,
+                confirmacion_info.get("nombre_recibe", None) or None,
+                confirmacion_info.get("firma_recibe", None) or None,
+            ]
         )
-        result["retry_info"] = retry_result
-        # En reintentos, devolver error si sigue fallando
-        return result
-
-    # Procesamiento exitoso
-    entrega.estado = "ENTREGADA"
-    entrega.fecha_entrega = datetime.now()
-    entrega.direccion = (
-        encrypt(confirmacion_info.get("direccion", None))
-        if confirmacion_info.get("direccion", None)
-        else None
-    )
-    entrega.nombre_recibe = (
-        encrypt(confirmacion_info.get("nombre_recibe", None))
-        if confirmacion_info.get("nombre_recibe", None)
-        else None
-    )
-    entrega.firma_recibe = (
-        encrypt(confirmacion_info.get("firma_recibe", None))
-        if confirmacion_info.get("firma_recibe", None)
-        else None
-    )
-    entrega.integridad_firma = confirmacion_info.get("firma_payload", None)
+    with etapa("worker.transicion"):
+        transicion_aplicada = _transicionar(
+            entrega_id,
+            "ENTREGADA",
+            version=version_leida,
+            fecha_entrega=datetime.now(),
+            direccion=direccion,
+            nombre_recibe=nombre_recibe,
+            firma_recibe=firma_recibe,
+            integridad_firma=confirmacion_info.get("firma_payload", None),
+        )
+    if not transicion_aplicada:
+        return _resultado_sin_transicion(entrega_id, idem_key)
 
-    db.session.commit()
     result = {
         "entrega_id": entrega_id,
         "status": "ENTREGADA",
         "timestamp": datetime.now().isoformat(),
         "worker": "logistica_worker",
-        "retry_count": _retry_count,
+        "retry_count": retry_count,
         "detalles": {
             "validado": True,
             "costo_calculado": 150.00,
@@ -202,8 +327,11 @@ def procesar_entrega_impl(
     return result
 
 
-def validar_inventario_impl(producto_id, cantidad):
+def validar_inventario_impl(producto_id, cantidad, **kwargs):
     """Valida disponibilidad en inventario"""
+    required_signed_celery_message(
+        kwargs, "logistica.validar_inventario", [producto_id, cantidad]
+    )
     print(
         f"📦 [LOGISTICA] Validando inventario: producto {producto_id}, cantidad {cantidad}"
     )
@@ -226,8 +354,11 @@ def validar_inventario_impl(producto_id, cantidad):
     return result
 
 
-def generar_reporte_impl(fecha_inicio=None, fecha_fin=None):
+def generar_reporte_impl(fecha_inicio=None, fecha_fin=None, **kwargs):
     """Genera reporte de entregas"""
+    required_signed_celery_message(
+        kwargs, "logistica.generar_reporte", [fecha_inicio, fecha_fin]
+    )
     if not fecha_inicio:
         fecha_inicio = datetime.now().strftime("%Y-%m-%d")
     if not fecha_fin:
@@ -250,11 +381,92 @@ def generar_reporte_impl(fecha_inicio=None, fecha_fin=None):
     return result
 
 
+@with_app_context(app)
+def reencriptar_entregas_impl(batch_size=500, **kwargs):
+    """Migra los campos cifrados con el formato legacy (AES-CBC hex) al formato AES-GCM"""
+    required_signed_celery_message(kwargs, "logistica.reencriptar_entregas", [batch_size])
+    batch_size = batch_size or 500
+    print(f"🔐 [LOGISTICA] Re-encriptando entregas legacy (lote {batch_size})")
+
+    campos = (Entrega.direccion, Entrega.nombre_recibe, Entrega.firma_recibe)
+    filtro_legacy = or_(
+        *[and_(campo.like("%:%"), ~campo.like(f"{GCM_PREFIX}%")) for campo in campos]
+    )
+
+    ultimo_id = 0
+    migradas = 0
+    omitidas = []
+    while True:
+        lote = (
+            Entrega.query.filter(Entrega.id > ultimo_id, filtro_legacy)
+            .order_by(Entrega.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not lote:
+            break
+
+        for entrega in lote:
+            # El LIKE solo preselecciona: is_legacy_ciphertext decide por valor y
+            # un texto plano con ':' (ej: una dirección) se deja como está
+            try:
+                (entrega.direccion, entrega.nombre_recibe, entrega.firma_recibe) = reencrypt_many(
+                    [entrega.direccion, entrega.nombre_recibe, entrega.firma_recibe]
+                )
+                migradas += 1
+            except ValueError as e:
+                print(f"⚠️ [LOGISTICA] Entrega {entrega.id} no se pudo re-encriptar, se omite: {e}")
+                omitidas.append(entrega.id)
+        db.session.commit()
+
+        ultimo_id = lote[-1].id
+        print(f"🔐 [LOGISTICA] {migradas} entregas re-encriptadas (último id {ultimo_id})")
+
+    result = {
+        "entregas_migradas": migradas,
+        "entregas_omitidas": omitidas,
+        "timestamp": datetime.now().isoformat(),
+        "worker": "logistica_worker",
+    }
+    print(f"✅ [LOGISTICA] Re-encriptación completada: {migradas} entregas")
+    return result
+
+
+def replay_dead_letters_impl(batch_size=100, rate_per_second=200, max_items=None, **kwargs):
+    """Re-despacha las entregas de la dead-letter queue en lotes con límite de tasa"""
+    required_signed_celery_message(
+        kwargs,
+        "logistica.replay_dead_letters",
+        [batch_size, rate_per_second, max_items],
+    )
+    print(
+        f"♻️ [LOGISTICA] Replay de DLQ: lote {batch_size}, {rate_per_second} tareas/s, máximo {max_items}"
+    )
+    result = replay_dead_letters(
+        "logistica.procesar_entrega",
+        LogisticaTasks.redispatch_dead_letters,
+        batch_size=batch_size or 100,
+        rate_per_second=rate_per_second or 200,
+        max_items=max_items,
+    )
+    result["worker"] = "logistica_worker"
+    print(f"✅ [LOGISTICA] Replay de DLQ completado: {result['replayed']} re-despachadas")
+    return result
+
+
 # Registrar tareas con nombres específicos
-procesar_entrega = _register_task(procesar_entrega_impl, "logistica.procesar_entrega")
+procesar_entrega = _register_task(
+    procesar_entrega_impl, "logistica.procesar_entrega", bind=True
+)
 validar_inventario = _register_task(
     validar_inventario_impl, "logistica.validar_inventario"
 )
 generar_reporte = _register_task(generar_reporte_impl, "logistica.generar_reporte")
+reencriptar_entregas = _register_task(
+    reencriptar_entregas_impl, "logistica.reencriptar_entregas"
+)
+replay_dead_letters_task = _register_task(
+    replay_dead_letters_impl, "logistica.replay_dead_letters"
+)
 
 print("✓ Tareas de logística registradas")
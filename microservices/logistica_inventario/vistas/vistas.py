@@ -1,11 +1,14 @@
+import json
 import os
-from flask import request
+from flask import Response, request, stream_with_context
 import logging
-from scripts.utils import api_protect, decrypt, encrypt, get_api_protect_validation_result
+from scripts.utils import api_protect, decrypt_many, encrypt, encrypt_many, get_api_protect_validation_result
 from ..services import sync_procesar_entrega
+from microservices.callers.m_callers import call_ms
 from ..modelos import db, Entrega, EntregaSchema
 from flask_restful import Resource
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -13,11 +16,25 @@ logger = logging.getLogger(__name__)
 from flask_jwt_extended import get_jwt, jwt_required, create_access_token
 from datetime import datetime
 from celery_app.dispatcher import LogisticaTasks, MonitorTasks, task_dispatcher
+from celery_app.dead_letter import dead_letter_count, peek_dead_letters
 
 # Importar celery desde la configuración global
 entrega_schema = EntregaSchema()
 
 
+def _validar_entrega(data):
+    """Valida los campos requeridos para crear una entrega. Retorna el mensaje de error o None"""
+    if not isinstance(data, dict):
+        return "cada entrega debe ser un objeto JSON"
+    if data.get("direccion") is None:
+        return "direccion es requerida"
+    if data.get("estado") is None:
+        return "estado es requerido"
+    if data.get("pedido_id") is None:
+        return "pedido_id es requerido"
+    return None
+
+
 class VistaEntregas(Resource):
 
     def post(self):
@@ -25,12 +42,9 @@ class VistaEntregas(Resource):
         if not data:
             return {"error": "Body JSON requerido"}, 400
         
-        if data.get("direccion") is None:
-            return {"error": "direccion es requerida"}, 400
-        if data.get("estado") is None:
-            return {"error": "estado es requerido"}, 400
-        if data.get("pedido_id") is None:
-            return {"error": "pedido_id es requerido"}, 400
+        error = _validar_entrega(data)
+        if error:
+            return {"error": error}, 400
         
         direccion_encrypted = encrypt(data["direccion"])
         nueva_entrega = Entrega(
@@ -43,25 +57,195 @@ class VistaEntregas(Resource):
         return entrega_schema.dump(nueva_entrega)
 
     def get(self):
-        return [entrega_schema.dump(ca) for ca in Entrega.query.all()]
+        """
+        Lista entregas; paginadas por keyset sobre id si se envía limit o cursor.
+
+        Query params:
+            limit: Tamaño de página (por defecto ENTREGAS_PAGE_SIZE, máximo ENTREGAS_MAX_PAGE_SIZE)
+            cursor: Último id recibido; la página empieza después de él
+            estado, pedido_id: Filtros opcionales
+            format: 'ndjson' para recibir un stream con una entrega por línea
+
+        Sin limit ni cursor responde un arreglo, como antes (lo consume el
+        frontend), pero acotado a ENTREGAS_PAGE_SIZE; si hay más entregas se
+        indica con el header X-Next-Cursor. Con paginación responde
+        {"entregas": [...], "next_cursor": ...} (también en el header);
+        next_cursor es null en la última página.
+        """
+        paginada = "limit" in request.args or "cursor" in request.args
+        try:
+            cursor = int(request.args.get("cursor", 0))
+            limit = int(request.args["limit"]) if "limit" in request.args else None
+        except ValueError:
+            return {"error": "cursor y limit deben ser enteros"}, 400
+
+        max_limit = int(os.getenv("ENTREGAS_MAX_PAGE_SIZE", "1000"))
+        if limit is not None and not 0 < limit <= max_limit:
+            return {"error": f"limit debe estar entre 1 y {max_limit}"}, 400
+
+        query = Entrega.query
+        if request.args.get("estado"):
+            query = query.filter(Entrega.estado == request.args["estado"])
+        if request.args.get("pedido_id"):
+            query = query.filter(Entrega.pedido_id == request.args["pedido_id"])
+
+        wants_ndjson = request.args.get("format") == "ndjson" or (
+            request.accept_mimetypes.best == "application/x-ndjson"
+        )
+        if wants_ndjson:
+            return Response(
+                stream_with_context(_stream_entregas(query, cursor, limit)),
+                mimetype="application/x-ndjson",
+            )
+
+        limit = limit or int(os.getenv("ENTREGAS_PAGE_SIZE", "100"))
+        page = (
+            query.filter(Entrega.id > cursor)
+            .order_by(Entrega.id)
+            .limit(limit + 1)
+            .all()
+        )
+        next_cursor = None
+        headers = {}
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = page[-1].id
+            headers["X-Next-Cursor"] = str(next_cursor)
+
+        if not paginada:
+            return entrega_schema.dump(page, many=True), 200, headers
+        return {
+            "entregas": entrega_schema.dump(page, many=True),
+            "next_cursor": next_cursor,
+        }, 200, headers
+
+
+def _stream_entregas(query, cursor, limit=None, batch_size=500):
+    """Genera entregas en formato NDJSON leyendo la tabla por lotes de keyset"""
+    enviadas = 0
+    while limit is None or enviadas < limit:
+        size = batch_size if limit is None else min(batch_size, limit - enviadas)
+        lote = query.filter(Entrega.id > cursor).order_by(Entrega.id).limit(size).all()
+        if not lote:
+            break
+        for entrega in lote:
+            yield json.dumps(entrega_schema.dump(entrega)) + "\n"
+        enviadas += len(lote)
+        cursor = lote[-1].id
+        # Liberar las instancias del lote del identity map
+        db.session.expunge_all()
+
+
+class VistaEntregasBulk(Resource):
+    """
+    Creación masiva de entregas en una sola transacción
+    """
+
+    def post(self):
+        data = request.get_json()
+        entregas = data.get("entregas") if isinstance(data, dict) else data
+        if not isinstance(entregas, list) or not entregas:
+            return {"error": "Se requiere una lista no vacía de entregas"}, 400
+
+        max_items = int(os.getenv("ENTREGAS_BULK_MAX", "5000"))
+        if len(entregas) > max_items:
+            return {"error": f"Máximo {max_items} entregas por petición"}, 413
+
+        errores = []
+        validas = []
+        for index, item in enumerate(entregas):
+            error = _validar_entrega(item)
+            if error:
+                errores.append({"index": index, "error": error})
+            else:
+                validas.append((index, item))
+
+        if not validas:
+            return {"creadas": [], "errores": errores}, 400
+
+        direcciones = encrypt_many([item["direccion"] for _, item in validas])
+        rows = [
+            {
+                "direccion": direccion,
+                "estado": item["estado"],
+                "pedido_id": item["pedido_id"],
+            }
+            for (_, item), direccion in zip(validas, direcciones)
+        ]
+
+        try:
+            ids = db.session.execute(
+                insert(Entrega).returning(Entrega.id, sort_by_parameter_order=True),
+                rows,
+            ).scalars().all()
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Error en inserción masiva de entregas: {e}")
+            return {"error": "No fue posible crear las entregas", "errores": errores}, 500
+
+        creadas = [{"index": index, "id": id_entrega} for (index, _), id_entrega in zip(validas, ids)]
+        return {
+            "creadas": creadas,
+            "errores": errores,
+            "total_creadas": len(creadas),
+            "total_errores": len(errores),
+        }, 207 if errores else 201
+
+
+ENTREGA_CAMPOS = (
+    "id",
+    "direccion",
+    "pedido_id",
+    "estado",
+    "nombre_recibe",
+    "firma_recibe",
+    "integridad_firma",
+    "fecha_entrega",
+    "version",
+)
+ENTREGA_CAMPOS_CIFRADOS = ("direccion", "nombre_recibe", "firma_recibe")
 
 
 class VistaEntrega(Resource):
 
     def get(self, id_entrega):
-        entrega = Entrega.query.get(id_entrega)
+        """
+        Consulta una entrega. El query param fields=estado,fecha_entrega limita las
+        columnas leídas y solo descifra los campos cifrados solicitados.
+        """
+        campos = ENTREGA_CAMPOS
+        if request.args.get("fields"):
+            campos = tuple(c.strip() for c in request.args["fields"].split(",") if c.strip())
+            invalidos = [c for c in campos if c not in ENTREGA_CAMPOS]
+            if invalidos:
+                return {"error": f"Campos no válidos: {', '.join(invalidos)}", "campos_disponibles": list(ENTREGA_CAMPOS)}, 400
+
+        entrega = (
+            db.session.query(*[getattr(Entrega, c) for c in campos])
+            .filter(Entrega.id == id_entrega)
+            .first()
+        )
         if not entrega:
             return {"mensaje": "Entrega no encontrada"}, 404
-        return {
-            "id": entrega.id,
-            "direccion": decrypt(entrega.direccion) if entrega.direccion and ':' in entrega.direccion else None,
-            "pedido_id": entrega.pedido_id,
-            "estado": entrega.estado,
-            "nombre_recibe": decrypt(entrega.nombre_recibe) if entrega.nombre_recibe and ':' in entrega.nombre_recibe else None,
-            "firma_recibe": decrypt(entrega.firma_recibe) if entrega.firma_recibe and ':' in entrega.firma_recibe else None,
-            "integridad_firma": entrega.integridad_firma,
-            "fecha_entrega": datetime.fromtimestamp(entrega.fecha_entrega.timestamp()).isoformat() if entrega.fecha_entrega else None,
-        }
+
+        resultado = dict(entrega._mapping)
+
+        cifrados = [c for c in campos if c in ENTREGA_CAMPOS_CIFRADOS]
+        if cifrados:
+            descifrados = decrypt_many(
+                [
+                    resultado[c] if resultado[c] and ':' in resultado[c] else None
+                    for c in cifrados
+                ]
+            )
+            resultado.update(zip(cifrados, descifrados))
+
+        if "fecha_entrega" in resultado:
+            fecha_entrega = resultado["fecha_entrega"]
+            resultado["fecha_entrega"] = datetime.fromtimestamp(fecha_entrega.timestamp()).isoformat() if fecha_entrega else None
+
+        return resultado
 
 
 class VistaConfirmarEntrega(Resource):
@@ -111,10 +295,45 @@ class VistaTareas(Resource):
     """
 
     def get(self):
-        tasks = task_dispatcher.list_tasks_from_redis()
+        """
+        Lista tareas paginando el backend de resultados.
+
+        Query params: cursor (SCAN cursor), limit, state, name.
+        Con state/name una página puede traer menos de limit tareas aunque
+        queden más: si next_cursor != 0 hay que seguir pidiendo páginas
+        (scan_budget_exhausted indica que se cortó por el presupuesto de SCAN).
+        Con source=index la consulta se resuelve en el índice por eventos del monitor.
+        """
+        if request.args.get("source") == "index":
+            (response, status_code) = call_ms(
+                "monitor", "/monitor/tareas", params=request.args.to_dict()
+            )
+            if status_code != 200:
+                return response, status_code
+            return {
+                "message": "Lista de tareas desde el índice del monitor",
+                "tasks": response["data"].get("tasks", []),
+                "next_cursor": 0,
+            }, 200
+
+        try:
+            cursor = int(request.args.get("cursor", 0))
+            limit = int(request.args.get("limit", 100))
+        except ValueError:
+            return {"error": "cursor y limit deben ser enteros"}, 400
+
+        page = task_dispatcher.list_tasks_from_redis(
+            cursor=cursor,
+            count=min(max(limit, 1), 1000),
+            state=request.args.get("state"),
+            name=request.args.get("name"),
+        )
         return {
             "message": "Lista de tareas en Redis",
-            "tasks": [task for task in tasks],
+            "tasks": page["tasks"],
+            "next_cursor": page["next_cursor"],
+            "scanned_keys": page["scanned_keys"],
+            "scan_budget_exhausted": page["scan_budget_exhausted"],
         }, 200
 
     @api_protect(
@@ -166,6 +385,11 @@ class VistaTareas(Resource):
 
             return {"message": "Reporte enviado via dispatcher", **task_result}, 202
 
+        elif tipo_tarea == "reencriptar_entregas":
+            task_result = LogisticaTasks.reencriptar_entregas(data.get("batch_size", 500))
+
+            return {"message": "Re-encriptación enviada via dispatcher", **task_result}, 202
+
         elif tipo_tarea == "health_check":
             task_result = MonitorTasks.health_check()
 
@@ -206,6 +430,7 @@ class VistaTareas(Resource):
                         "fecha_inicio": "2025-01-01",
                         "fecha_fin": "2025-01-31",
                     },
+                    {"tipo": "reencriptar_entregas", "batch_size": 500},
                     {"tipo": "health_check"},
                     {
                         "tipo": "log_activity",
@@ -216,6 +441,52 @@ class VistaTareas(Resource):
             }, 400
 
 
+class VistaDeadLetters(Resource):
+    """
+    Dead-letter queue de entregas que agotaron sus reintentos
+    """
+
+    @api_protect(
+        {
+            "jwt_required": False,
+            "api_key_required": False,
+            "roles_required": ["Admin", "System"],
+        }
+    )
+    def get(self):
+        limit = min(request.args.get("limit", 50, type=int), 500)
+        entradas = peek_dead_letters("logistica.procesar_entrega", limit)
+        return {
+            "total": dead_letter_count("logistica.procesar_entrega"),
+            "entradas": [
+                {
+                    "entrega_id": entrada["args"][0],
+                    "task_id": entrada.get("task_id"),
+                    "error": entrada.get("error"),
+                    "failed_at": entrada.get("failed_at"),
+                }
+                for entrada in entradas
+            ],
+        }, 200
+
+    @api_protect(
+        {
+            "jwt_required": False,
+            "api_key_required": False,
+            "roles_required": ["Admin", "System"],
+        }
+    )
+    def post(self):
+        """Lanza el replay de la DLQ como tarea asíncrona en el worker"""
+        data = request.get_json(silent=True) or {}
+        task_result = LogisticaTasks.replay_dead_letters(
+            data.get("batch_size", 100),
+            data.get("rate_per_second", 200),
+            data.get("max_items"),
+        )
+        return {"message": "Replay de DLQ enviado via dispatcher", **task_result}, 202
+
+
 class VistaTareaDetail(Resource):
     """
     Endpoint para consultar el estado de una tarea asíncrona por ID
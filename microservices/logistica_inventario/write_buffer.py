@@ -0,0 +1,142 @@
+"""
+Group-commit de escrituras del worker de logística
+
+Las transiciones de estado de varias tareas concurrentes (worker con
+--pool threads o gevent) se acumulan en un buffer y se aplican en una sola
+transacción cada GROUP_COMMIT_MAX_MS milisegundos o cada
+GROUP_COMMIT_MAX_UPDATES actualizaciones, lo que ocurra primero. Con SQLite
+esto reduce los fsync a uno por lote en lugar de uno por entrega.
+
+Cada tarea espera a que su lote haga commit antes de retornar, así con
+task_acks_late el mensaje solo se confirma al broker después del commit.
+
+Se habilita con ENTREGA_GROUP_COMMIT=1; en un worker prefork cada proceso
+ejecuta una tarea a la vez, por lo que los lotes serán de una sola escritura.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+from microservices.logistica_inventario.modelos import db
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ENTREGA_GROUP_COMMIT = os.getenv("ENTREGA_GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_MAX_UPDATES = int(os.getenv("GROUP_COMMIT_MAX_UPDATES", "100"))
+GROUP_COMMIT_MAX_MS = float(os.getenv("GROUP_COMMIT_MAX_MS", "20"))
+GROUP_COMMIT_TIMEOUT = float(os.getenv("GROUP_COMMIT_TIMEOUT", "30"))
+
+
+class GroupCommitBuffer:
+    """Buffer de sentencias que un hilo de fondo aplica en transacciones por lote"""
+
+    def __init__(self, app, max_updates: int = 100, max_ms: float = 20):
+        self.app = app
+        self.max_updates = max_updates
+        self.max_wait = max_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[object, Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self.batches = 0
+        self.updates = 0
+
+    def _ensure_started(self):
+        # Los hilos no sobreviven al fork del worker prefork: iniciar por proceso
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name="group-commit", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, stmt) -> Future:
+        """Encola una sentencia; el Future se resuelve con su rowcount tras el commit"""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((stmt, future))
+        return future
+
+    def execute(self, stmt, timeout: Optional[float] = None) -> int:
+        """Encola la sentencia y bloquea hasta que su lote haga commit"""
+        return self.submit(stmt).result(timeout=timeout)
+
+    def _collect(self) -> List[Tuple[object, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_updates:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        with self.app.app_context():
+            engine = db.engine
+            while True:
+                batch = self._collect()
+                try:
+                    self._flush(engine, batch)
+                except Exception as e:
+                    logger.exception(f"Error inesperado en group-commit: {e}")
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def _flush(self, engine, batch: List[Tuple[object, Future]]):
+        try:
+            with engine.begin() as conn:
+                rowcounts = [conn.execute(stmt).rowcount for stmt, _ in batch]
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Aislar la sentencia que falla: aplicar el lote una a una
+            logger.warning(f"Lote de {len(batch)} escrituras falló ({e}), aplicando individualmente")
+            for item in batch:
+                self._flush(engine, [item])
+            return
+
+        self.batches += 1
+        self.updates += len(batch)
+        for (_, future), rowcount in zip(batch, rowcounts):
+            future.set_result(rowcount)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "updates": self.updates,
+            "pending": self._queue.qsize(),
+            "avg_batch_size": round(self.updates / self.batches, 2) if self.batches else 0,
+        }
+
+
+_buffer: Optional[GroupCommitBuffer] = None
+_buffer_lock = threading.Lock()
+
+
+def get_write_buffer(app) -> GroupCommitBuffer:
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = GroupCommitBuffer(
+                    app,
+                    max_updates=GROUP_COMMIT_MAX_UPDATES,
+                    max_ms=GROUP_COMMIT_MAX_MS,
+                )
+    return _buffer
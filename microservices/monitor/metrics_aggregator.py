@@ -0,0 +1,297 @@
+"""
+Agregación de las métricas Prometheus de todos los servicios y del worker
+
+Consulta en paralelo el /metrics de cada objetivo (METRICS_TARGETS), suma
+las series con los mismos labels y arma un resumen de capacidad: throughput
+y latencia HTTP por servicio, resultados/reintentos/latencia por tarea y
+profundidad de las colas.
+
+Los contadores e histogramas se suman; los gauges se combinan con el máximo,
+porque cada worker reporta la misma profundidad de las colas del broker.
+
+METRICS_TARGETS: lista "nombre=url" separada por comas.
+"""
+
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import requests
+
+from shared.metrics import estimate_quantile, render_registry
+
+DEFAULT_METRICS_TARGETS = (
+    "logistica-inventario=http://m-logistica-inventario:5002/metrics,"
+    "autorizador=http://m-autorizador:5003/metrics,"
+    "monitor=http://m-monitor:5001/metrics,"
+    "worker=http://celery-worker:9808/metrics"
+)
+METRICS_SCRAPE_TIMEOUT = float(os.getenv("METRICS_SCRAPE_TIMEOUT", "2"))
+# Objetivo que corresponde al propio servicio monitor
+MONITOR_TARGET = "monitor"
+
+SAMPLE_LINE = re.compile(
+    r"^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(?P<labels>.*)\})?\s+(?P<value>\S+)"
+)
+LABEL_PAIR = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def metrics_targets() -> Dict[str, str]:
+    targets = {}
+    for item in os.getenv("METRICS_TARGETS", DEFAULT_METRICS_TARGETS).split(","):
+        name, _, url = item.strip().partition("=")
+        if name and url:
+            targets[name] = url
+    return targets
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _unescape(value):
+    return value.replace('\\"', '"').replace("\\n", "\n").replace("\\\\", "\\")
+
+
+def parse_exposition(text):
+    """
+    Parsea el formato de texto de Prometheus.
+
+    Returns:
+        (tipos, ayudas, muestras) donde muestras es {(nombre, labels): valor}
+        y labels es una tupla ordenada de pares (label, valor)
+    """
+    types, helps, samples = {}, {}, {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("# TYPE "):
+            parts = line.split(None, 3)
+            if len(parts) == 4:
+                types[parts[2]] = parts[3]
+            continue
+        if line.startswith("# HELP "):
+            parts = line.split(None, 3)
+            helps[parts[2]] = parts[3] if len(parts) == 4 else ""
+            continue
+        if line.startswith("#"):
+            continue
+        match = SAMPLE_LINE.match(line)
+        if not match:
+            continue
+        labels = tuple(sorted(
+            (name, _unescape(value)) for name, value in LABEL_PAIR.findall(match.group("labels") or "")
+        ))
+        try:
+            samples[(match.group("name"), labels)] = float(match.group("value"))
+        except ValueError:
+            continue
+    return types, helps, samples
+
+
+def scrape(
+    targets: Optional[Dict[str, str]] = None,
+    timeout: float = METRICS_SCRAPE_TIMEOUT,
+    local: Optional[str] = None,
+):
+    """
+    Consulta en paralelo el /metrics de cada objetivo.
+
+    El objetivo local (ej: MONITOR_TARGET desde el propio monitor) se renderiza
+    en proceso con render_registry en vez de llamarse a sí mismo por HTTP.
+    """
+    targets = targets or metrics_targets()
+
+    def fetch(item):
+        name, url = item
+        started = time.perf_counter()
+        if name == local:
+            return name, {"up": True, "text": render_registry()}, started
+        try:
+            response = requests.get(url, timeout=timeout)
+            response.raise_for_status()
+            return name, {"up": True, "text": response.text}, started
+        except requests.RequestException as e:
+            return name, {"up": False, "error": str(e)}, started
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(targets))) as executor:
+        for name, result, started in executor.map(fetch, targets.items()):
+            result["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            results[name] = result
+    return results
+
+
+def aggregate(scrapes):
+    """Suma las muestras de todos los objetivos disponibles (máximo para los gauges)"""
+    types, helps, samples = {}, {}, {}
+    for result in scrapes.values():
+        if not result.get("up"):
+            continue
+        target_types, target_helps, target_samples = parse_exposition(result["text"])
+        types.update(target_types)
+        helps.update(target_helps)
+        for key, value in target_samples.items():
+            if key not in samples:
+                samples[key] = value
+            elif types.get(key[0]) == "gauge":
+                samples[key] = max(samples[key], value)
+            else:
+                samples[key] += value
+    return types, helps, samples
+
+
+def _family(name, types):
+    for suffix in ("_bucket", "_sum", "_count"):
+        if name.endswith(suffix) and types.get(name[: -len(suffix)]) == "histogram":
+            return name[: -len(suffix)]
+    return name
+
+
+def _format_sample(name, labels, value):
+    label_text = ""
+    if labels:
+        label_text = "{" + ",".join(f'{key}="{_escape(val)}"' for key, val in labels) + "}"
+    number = "+Inf" if value == float("inf") else (str(int(value)) if value.is_integer() else repr(value))
+    return f"{name}{label_text} {number}"
+
+
+def render_aggregate(scrapes):
+    """Texto de exposición con el agregado y el estado de cada scrape"""
+    types, helps, samples = aggregate(scrapes)
+    lines = [
+        "# HELP monitor_scrape_up 1 si el objetivo respondió su /metrics",
+        "# TYPE monitor_scrape_up gauge",
+    ]
+    lines += [
+        _format_sample("monitor_scrape_up", (("target", name),), 1.0 if result["up"] else 0.0)
+        for name, result in sorted(scrapes.items())
+    ]
+    lines += [
+        "# HELP monitor_scrape_duration_ms Duración del scrape",
+        "# TYPE monitor_scrape_duration_ms gauge",
+    ]
+    lines += [
+        _format_sample("monitor_scrape_duration_ms", (("target", name),), float(result["duration_ms"]))
+        for name, result in sorted(scrapes.items())
+    ]
+
+    families = {}
+    for (name, labels), value in samples.items():
+        families.setdefault(_family(name, types), []).append((name, labels, value))
+    for family in sorted(families):
+        lines.append(f"# HELP {family} {helps.get(family, '')}")
+        lines.append(f"# TYPE {family} {types.get(family, 'untyped')}")
+        for name, labels, value in sorted(families[family], key=_sample_order):
+            lines.append(_format_sample(name, labels, value))
+    return "\n".join(lines) + "\n"
+
+
+def _sample_order(sample):
+    name, labels, _ = sample
+    le = dict(labels).get("le")
+    le_value = float("inf") if le in (None, "+Inf") else float(le)
+    return (tuple(pair for pair in labels if pair[0] != "le"), name, le_value)
+
+
+def _histogram_stats(samples, name, group_by):
+    """count, media y p50/p99 de un histograma agrupado por el label group_by"""
+    buckets = {}
+    stats = {}
+    for (sample_name, labels), value in samples.items():
+        label_map = dict(labels)
+        key = label_map.get(group_by)
+        if sample_name == f"{name}_bucket":
+            le = label_map.get("le")
+            bound = float("inf") if le == "+Inf" else float(le)
+            per_key = buckets.setdefault(key, {})
+            per_key[bound] = per_key.get(bound, 0.0) + value
+        elif sample_name in (f"{name}_sum", f"{name}_count"):
+            field = "sum" if sample_name.endswith("_sum") else "count"
+            stats.setdefault(key, {"sum": 0.0, "count": 0.0})[field] += value
+
+    result = {}
+    for key, values in stats.items():
+        per_key = buckets.get(key, {})
+        bounds = sorted(per_key)
+        cumulative = [per_key[bound] for bound in bounds]
+        counts = [b - a for a, b in zip([0.0] + cumulative[:-1], cumulative)]
+        finite = [bound for bound in bounds if bound != float("inf")]
+        result[key] = {
+            "count": int(values["count"]),
+            "mean_ms": round(values["sum"] / values["count"], 3) if values["count"] else None,
+            "p50_ms": _round(estimate_quantile(finite, counts, 0.5)) if finite else None,
+            "p99_ms": _round(estimate_quantile(finite, counts, 0.99)) if finite else None,
+        }
+    return result
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+def capacity_summary(scrapes):
+    """Resumen para planificación de capacidad a partir de las métricas medidas"""
+    _, _, samples = aggregate(scrapes)
+
+    http = {}
+    for (name, labels), value in samples.items():
+        if name != "http_requests_total":
+            continue
+        label_map = dict(labels)
+        service = http.setdefault(label_map.get("service"), {"requests": 0, "errors_5xx": 0})
+        service["requests"] += int(value)
+        if label_map.get("status", "").startswith("5"):
+            service["errors_5xx"] += int(value)
+    for service, latency in _histogram_stats(samples, "http_request_duration_ms", "service").items():
+        http.setdefault(service, {"requests": 0, "errors_5xx": 0}).update(latency)
+    for service in http.values():
+        service["error_rate"] = (
+            round(service["errors_5xx"] / service["requests"], 4) if service["requests"] else None
+        )
+
+    tasks = {}
+    for (name, labels), value in samples.items():
+        label_map = dict(labels)
+        if name == "celery_tasks_total":
+            task = tasks.setdefault(label_map.get("task"), {"states": {}, "retries": 0})
+            task["states"][label_map.get("state")] = int(value)
+        elif name == "celery_task_retries_total":
+            tasks.setdefault(label_map.get("task"), {"states": {}, "retries": 0})["retries"] = int(value)
+    for task_name, latency in _histogram_stats(samples, "celery_task_duration_ms", "task").items():
+        tasks.setdefault(task_name, {"states": {}, "retries": 0})["duration"] = latency
+    for task_name, wait in _histogram_stats(samples, "celery_task_queue_wait_ms", "task").items():
+        tasks.setdefault(task_name, {"states": {}, "retries": 0})["queue_wait"] = wait
+    for task in tasks.values():
+        executions = sum(task["states"].values())
+        task["executions"] = executions
+        task["success_rate"] = (
+            round(task["states"].get("SUCCESS", 0) / executions, 4) if executions else None
+        )
+        task["retry_rate"] = round(task["retries"] / executions, 4) if executions else None
+
+    queues = {
+        dict(labels).get("queue"): int(value)
+        for (name, labels), value in samples.items()
+        if name == "celery_queue_depth"
+    }
+    dead_letter = {
+        dict(labels).get("task"): int(value)
+        for (name, labels), value in samples.items()
+        if name == "celery_dead_letter_depth"
+    }
+
+    return {
+        "targets": {
+            name: {"up": result["up"], "duration_ms": result["duration_ms"], "error": result.get("error")}
+            for name, result in scrapes.items()
+        },
+        "http": http,
+        "tasks": tasks,
+        "queues": queues,
+        "dead_letter": dead_letter,
+    }
+
@@ -4,7 +4,8 @@ import os
 # Agregar el directorio raíz al PYTHONPATH
 sys.path.insert(0, '/app')
 
-from flask import jsonify
+from flask import jsonify, request
+import asyncio
 import redis
 import requests
 import time
@@ -12,6 +13,10 @@ from datetime import datetime
 
 # Importar configuración compartida
 from shared import create_app, add_health_check
+from microservices.callers.m_callers import MS_CALLERS_MAP
+from microservices.callers.m_callers_async import call_many_sync
+from shared.metrics import PROMETHEUS_CONTENT_TYPE
+from .metrics_aggregator import MONITOR_TARGET, capacity_summary, render_aggregate, scrape
 # Removed setup_cors - CORS is handled by nginx API Gateway
 
 # Crear la aplicación usando la configuración compartida
@@ -26,6 +31,15 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
+# Índice de tareas alimentado por eventos de Celery
+task_index = None
+if os.getenv('MONITOR_TASK_INDEX', '1') == '1':
+    from celery_app.client import flask_celery
+    from .task_index import create_task_index
+
+    task_index = create_task_index(flask_celery)
+    task_index.start()
+
 # Agregar health check personalizado con timestamp
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -92,11 +106,50 @@ def workers_info():
     """Información sobre los workers de Celery"""
     try:
         # Obtener estadísticas de workers activos
-        active_workers = get_active_workers()
+        if task_index and task_index.connected:
+            active_workers = task_index.list_workers()
+            source = 'events'
+        else:
+            active_workers = get_active_workers()
+            source = 'redis'
         
         return jsonify({
             'workers': active_workers,
             'total_workers': len(active_workers),
+            'source': source,
+            'timestamp': datetime.now().isoformat()
+        })
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+@app.route('/monitor/tareas', methods=['GET'])
+def tareas_index():
+    """Consulta el índice de tareas (query params: state, name, worker, since, until, limit)"""
+    if not task_index:
+        return jsonify({
+            'error': 'Índice de tareas deshabilitado (MONITOR_TASK_INDEX=0)',
+            'timestamp': datetime.now().isoformat()
+        }), 503
+    try:
+        since = request.args.get('since', type=float)
+        until = request.args.get('until', type=float)
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+
+        tasks = task_index.query_tasks(
+            state=request.args.get('state'),
+            name=request.args.get('name'),
+            worker=request.args.get('worker'),
+            since=since,
+            until=until,
+            limit=limit,
+        )
+        return jsonify({
+            'tasks': tasks,
+            'total': len(tasks),
+            'index': task_index.stats(),
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
@@ -108,6 +161,11 @@ def workers_info():
 @app.route('/monitor/ping-logistica', methods=['GET'])
 def ping_logistica():
     """Ping echo al microservicio de Logística e Inventarios"""
+    data, status_code = ping_logistica_data()
+    return jsonify(data), status_code
+
+def ping_logistica_data():
+    """Ejecuta el ping a logística y devuelve (resultado, status_code) sin depender del contexto Flask"""
     try:
         start_time = time.time()
         
@@ -124,7 +182,7 @@ def ping_logistica():
             status = "degraded"
             message = f"Servicio de logística con problemas - código {health_response.status_code}"
             
-        return jsonify({
+        return {
             'target_service': 'logistica_inventario',
             'status': status,
             'message': message,
@@ -132,10 +190,10 @@ def ping_logistica():
             'http_status': health_response.status_code,
             'timestamp': datetime.now().strftime('%H:%M:%S'),
             'ping_successful': health_response.status_code == 200
-        })
+        }, 200
         
     except requests.exceptions.Timeout:
-        return jsonify({
+        return {
             'target_service': 'logistica_inventario',
             'status': 'timeout',
             'message': 'Timeout en confirmación de entrega - sistema enmascarando falla y procesando asíncronamente en Broker de mensajería',
@@ -143,10 +201,10 @@ def ping_logistica():
             'http_status': None,
             'timestamp': datetime.now().strftime('%H:%M:%S'),
             'ping_successful': False
-        }), 408
+        }, 408
         
     except requests.exceptions.ConnectionError:
-        return jsonify({
+        return {
             'target_service': 'logistica_inventario',
             'status': 'unreachable',
             'message': 'Error de conexión al microservicio de logística - sistema enmascarando falla y procesando asíncronamente en Broker de mensajería',
@@ -154,10 +212,10 @@ def ping_logistica():
             'http_status': None,
             'timestamp': datetime.now().strftime('%H:%M:%S'),
             'ping_successful': False
-        }), 503
+        }, 503
         
     except Exception as e:
-        return jsonify({
+        return {
             'target_service': 'logistica_inventario',
             'status': 'error',
             'message': f'Error inesperado: {str(e)}',
@@ -165,17 +223,21 @@ def ping_logistica():
             'http_status': None,
             'timestamp': datetime.now().strftime('%H:%M:%S'),
             'ping_successful': False
-        }), 500
+        }, 500
+
+async def _gather_logistica_checks():
+    """Ejecuta el ping y la verificación del broker en paralelo"""
+    return await asyncio.gather(
+        asyncio.to_thread(ping_logistica_data),
+        asyncio.to_thread(check_broker_connectivity),
+    )
 
 @app.route('/monitor/logistica-status', methods=['GET'])
 def logistica_status():
     """Estado detallado del microservicio de Logística e Inventarios"""
     try:
-        ping_result = ping_logistica()
-        ping_data = ping_result.get_json()
+        (ping_data, _), broker_status = asyncio.run(_gather_logistica_checks())
         is_healthy = ping_data.get('ping_successful', False)
-    
-        broker_status = check_broker_connectivity()
         
         if is_healthy and broker_status['redis_connected']:
             overall_status = 'healthy'
@@ -201,6 +263,47 @@ def logistica_status():
             'last_check': datetime.now().isoformat()
         }), 500
 
+@app.route('/monitor/services-health', methods=['GET'])
+def services_health():
+    """Health check agregado de todos los microservicios, consultados en paralelo"""
+    services = [name for name in MS_CALLERS_MAP if name != 'monitor']
+    start_time = time.time()
+    results = call_many_sync(
+        [{'name': name, 'resource': '/health'} for name in services],
+        timeout=float(os.getenv('MONITOR_HEALTH_TIMEOUT', '2')),
+    )
+    elapsed = round((time.time() - start_time) * 1000, 2)
+
+    services_status = {}
+    for name, (response, status_code) in zip(services, results):
+        services_status[name] = {
+            'status': 'healthy' if status_code == 200 else 'unhealthy',
+            'http_status': status_code,
+            'detail': response.get('data', response.get('error')),
+        }
+
+    all_healthy = all(s['status'] == 'healthy' for s in services_status.values())
+    return jsonify({
+        'overall_status': 'healthy' if all_healthy else 'degraded',
+        'services': services_status,
+        'response_time_ms': elapsed,
+        'timestamp': datetime.now().isoformat()
+    }), 200 if all_healthy else 503
+
+@app.route('/monitor/metrics', methods=['GET'])
+def aggregated_metrics():
+    """Métricas de todos los servicios y del worker agregadas (formato Prometheus)"""
+    return app.response_class(
+        render_aggregate(scrape(local=MONITOR_TARGET)), content_type=PROMETHEUS_CONTENT_TYPE
+    )
+
+@app.route('/monitor/metrics/summary', methods=['GET'])
+def metrics_summary():
+    """Resumen de capacidad: throughput, errores, latencia, reintentos y colas medidos"""
+    summary = capacity_summary(scrape(local=MONITOR_TARGET))
+    summary['timestamp'] = datetime.now().isoformat()
+    return jsonify(summary)
+
 def get_celery_info():
     """Obtiene información sobre Celery desde Redis"""
     try:
@@ -0,0 +1,157 @@
+"""
+Índice en memoria del estado de las tareas, alimentado por eventos de Celery.
+
+Un hilo en segundo plano consume los eventos que publican los workers y el
+cliente (task-sent, task-received, task-started, task-succeeded, ...) y los
+aplica sobre celery.events.state.State, que mantiene las tareas y workers en
+caches LRU acotados. Las consultas se resuelven en memoria sin broadcasts.
+"""
+
+import logging
+import os
+import threading
+from typing import Optional
+
+from celery.events.state import State
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TaskEventIndex:
+    """Índice de tareas y workers construido a partir de eventos de Celery"""
+
+    def __init__(self, celery_app, max_tasks: int = 10000, max_workers: int = 100):
+        self.celery = celery_app
+        self.state = State(
+            max_tasks_in_memory=max_tasks, max_workers_in_memory=max_workers
+        )
+        self._stop = threading.Event()
+        self._thread = None
+        self.connected = False
+
+    def start(self):
+        """Inicia el consumidor de eventos en un hilo daemon"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="celery-event-index", daemon=True
+        )
+        self._thread.start()
+        logger.info("✓ Índice de tareas por eventos iniciado")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.celery.connection() as connection:
+                    receiver = self.celery.events.Receiver(
+                        connection, handlers={"*": self.state.event}
+                    )
+                    self.connected = True
+                    receiver.capture(limit=None, timeout=None, wakeup=True)
+            except Exception as e:
+                logger.error(f"Error consumiendo eventos de Celery: {e}")
+            finally:
+                self.connected = False
+            # Reintentar la conexión con el broker
+            self._stop.wait(5)
+
+    @staticmethod
+    def _task_to_dict(task) -> dict:
+        return {
+            "id": task.uuid,
+            "name": task.name,
+            "state": task.state,
+            "worker": task.worker.hostname if task.worker else None,
+            "args": task.args,
+            "kwargs": task.kwargs,
+            "result": task.result,
+            "exception": task.exception,
+            "retries": task.retries,
+            "sent": task.sent,
+            "received": task.received,
+            "started": task.started,
+            "finished": task.succeeded or task.failed,
+            "runtime": task.runtime,
+            "timestamp": task.timestamp,
+            "source": "events",
+        }
+
+    def query_tasks(
+        self,
+        state: Optional[str] = None,
+        name: Optional[str] = None,
+        worker: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 100,
+    ) -> list:
+        """
+        Consulta tareas del índice, las más recientes primero.
+
+        Args:
+            since, until: Ventana de tiempo (epoch en segundos) sobre el último evento de la tarea
+        """
+
+        def _snapshot():
+            return list(self.state.tasks.values())
+
+        tasks = self.state.freeze_while(_snapshot)
+
+        found = []
+        for task in tasks:
+            if state and task.state != state:
+                continue
+            if name and task.name != name:
+                continue
+            if worker and (not task.worker or task.worker.hostname != worker):
+                continue
+            timestamp = task.timestamp or 0
+            if since and timestamp < since:
+                continue
+            if until and timestamp > until:
+                continue
+            found.append(task)
+
+        found.sort(key=lambda t: t.timestamp or 0, reverse=True)
+        return [self._task_to_dict(task) for task in found[:limit]]
+
+    def list_workers(self) -> list:
+        """Workers vistos por heartbeat/eventos"""
+
+        def _snapshot():
+            return list(self.state.workers.values())
+
+        return [
+            {
+                "hostname": w.hostname,
+                "status": "active" if w.alive else "offline",
+                "active": w.active,
+                "processed": w.processed,
+                "loadavg": w.loadavg,
+                "last_heartbeat": w.heartbeats[-1] if w.heartbeats else None,
+                "software": f"{w.sw_ident} {w.sw_ver}" if w.sw_ident else None,
+            }
+            for w in self.state.freeze_while(_snapshot)
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "event_count": self.state.event_count,
+            "task_count": self.state.task_count,
+            "tasks_in_memory": len(self.state.tasks),
+            "workers_in_memory": len(self.state.workers),
+        }
+
+
+def create_task_index(celery_app) -> TaskEventIndex:
+    """Crea el índice con los límites configurados por variables de entorno"""
+    return TaskEventIndex(
+        celery_app,
+        max_tasks=int(os.getenv("MONITOR_INDEX_MAX_TASKS", "10000")),
+        max_workers=int(os.getenv("MONITOR_INDEX_MAX_WORKERS", "100")),
+    )
@@ -5,6 +5,8 @@ import time
 import redis
 import os
 from datetime import datetime
+from scripts.utils import required_signed_celery_message
+from microservices.monitor.metrics_aggregator import capacity_summary, scrape
 
 # Solo importar cuando estamos en el contexto del worker
 try:
@@ -23,8 +25,9 @@ def _register_task(func, name):
     else:
         return func
 
-def health_check_impl():
+def health_check_impl(**kwargs):
     """Verifica la salud general del sistema"""
+    required_signed_celery_message(kwargs, 'monitor.health_check', [])
     print("🏥 [MONITOR] Ejecutando health check del sistema")
     
     # Verificar Redis
@@ -52,8 +55,9 @@ def health_check_impl():
     print(f"✅ [MONITOR] Health check completado - Status: {result['system_status']}")
     return result
 
-def log_activity_impl(activity_data):
+def log_activity_impl(activity_data, **kwargs):
     """Registra actividad del sistema"""
+    required_signed_celery_message(kwargs, 'monitor.log_activity', [activity_data])
     print(f"📝 [MONITOR] Registrando actividad: {activity_data}")
     time.sleep(0.5)
     
@@ -69,31 +73,28 @@ def log_activity_impl(activity_data):
     print(f"✅ [MONITOR] Actividad registrada: {log_entry['activity_id']}")
     return log_entry
 
-def generate_metrics_impl():
-    """Genera métricas del sistema"""
+def generate_metrics_impl(**kwargs):
+    """Genera métricas del sistema a partir de los /metrics de servicios y worker"""
+    required_signed_celery_message(kwargs, 'monitor.generate_metrics', [])
     print("📊 [MONITOR] Generando métricas del sistema")
-    time.sleep(2)
-    
-    # Simular recolección de métricas
+
+    summary = capacity_summary(scrape())
     result = {
         'metrics_id': f"MET_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
         'timestamp': datetime.now().isoformat(),
         'worker': 'monitor_worker',
-        'metrics': {
-            'cpu_usage': '25%',
-            'memory_usage': '60%',
-            'disk_usage': '45%',
-            'requests_per_minute': 120,
-            'response_time_avg': '180ms',
-            'active_tasks': 3
-        }
+        'metrics': summary
     }
-    
+
+    caidos = [name for name, target in summary['targets'].items() if not target['up']]
+    if caidos:
+        print(f"⚠️ [MONITOR] Objetivos sin métricas: {', '.join(caidos)}")
     print(f"✅ [MONITOR] Métricas generadas: {result['metrics_id']}")
     return result
 
-def ping_logistica_async_impl():
+def ping_logistica_async_impl(**kwargs):
     """Ping echo asíncrono al microservicio de Logística e Inventarios"""
+    required_signed_celery_message(kwargs, 'monitor.ping_logistica', [])
     print("🏥 [MONITOR] Ejecutando ping echo a Logística e Inventarios")
     
     try:
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Análisis en streaming de los logs del worker, logística y autorizador.
+
+Lee los archivos línea a línea (memoria acotada sin importar su tamaño) y
+calcula por tarea/ruta y estado: conteo, p50/p90/p99 de duración con un
+sketch logarítmico mergeable (error relativo acotado), y tasas de éxito y
+reintento por tarea.
+
+Formatos reconocidos:
+    - Eventos JSON de shared.log_schema (task_events.jsonl, logs de los servicios)
+    - Log de texto del worker: "Task <nombre>[<id>] succeeded in <s>s: {...}",
+      "... retry: ..." y "... raised unexpected: ..."
+    - Log de texto de los servicios: "Response status: <código>" (solo conteos)
+
+Uso:
+    python scripts/log_analytics.py logs/celery/worker.log --format csv
+    python scripts/log_analytics.py logs/celery/task_events.jsonl --format json -o resumen.json
+    python scripts/log_analytics.py logs/celery/*.log --state .analytics_state.json
+    python scripts/log_analytics.py logs/celery/task_events.jsonl --follow --interval 10
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+WORKER_SUCCEEDED = re.compile(
+    r"Task\s+(?P<name>[\w.]+)\[(?P<task_id>[^\]]+)\]\s+succeeded\s+in\s+(?P<secs>[\d.eE+-]+)s:\s*(?P<payload>.*)$"
+)
+WORKER_RETRY = re.compile(r"Task\s+(?P<name>[\w.]+)\[(?P<task_id>[^\]]+)\]\s+retry:")
+WORKER_FAILED = re.compile(r"Task\s+(?P<name>[\w.]+)\[(?P<task_id>[^\]]+)\]\s+raised unexpected:")
+PAYLOAD_STATUS = re.compile(r"['\"]status['\"]:\s*['\"](?P<status>[A-Z_]+)['\"]")
+RESPONSE_STATUS = re.compile(r"Response status:\s*(?P<code>\d{3})")
+
+
+class LogSketch:
+    """
+    Sketch de cuantiles con buckets logarítmicos (estilo DDSketch).
+
+    Cada valor cae en el bucket ceil(log_gamma(x)); el cuantil estimado tiene
+    error relativo <= relative_accuracy. Dos sketches con la misma precisión
+    se combinan sumando sus buckets.
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-3):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.buckets = defaultdict(int)
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, value):
+        if value is None:
+            return
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+        if value <= self.min_value:
+            self.zero_count += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self._log_gamma)] += 1
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Solo se pueden combinar sketches con la misma precisión")
+        for index, count in other.buckets.items():
+            self.buckets[index] += count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Punto medio del bucket en escala relativa
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "min_value": self.min_value,
+            "buckets": {str(k): v for k, v in self.buckets.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"], data["min_value"])
+        sketch.buckets.update({int(k): v for k, v in data["buckets"].items()})
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.total = data["total"]
+        sketch.max = data["max"]
+        return sketch
+
+
+class LogAggregate:
+    """Duraciones por (tipo, nombre, estado) y contadores de resultado por tarea"""
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.groups = {}
+        self.counts = defaultdict(int)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+        self.lines = 0
+        self.matched = 0
+
+    def _sketch(self, key):
+        if key not in self.groups:
+            self.groups[key] = LogSketch(self.relative_accuracy)
+        return self.groups[key]
+
+    def record(self, kind, name, status, duration_ms=None, outcome=None):
+        key = (kind, name, str(status))
+        self.counts[key] += 1
+        self._sketch(key).add(duration_ms)
+        if outcome:
+            self.outcomes[name][outcome] += 1
+            self.outcomes[name]["executions"] += 1
+
+    def merge(self, other):
+        for key, sketch in other.groups.items():
+            self._sketch(key).merge(sketch)
+            self.counts[key] += other.counts[key]
+        for name, counters in other.outcomes.items():
+            for outcome, count in counters.items():
+                self.outcomes[name][outcome] += count
+        self.lines += other.lines
+        self.matched += other.matched
+
+    def rows(self):
+        for (kind, name, status), sketch in sorted(self.groups.items()):
+            row = {
+                "kind": kind,
+                "name": name,
+                "status": status,
+                "count": self.counts[(kind, name, status)],
+                "mean_ms": round(sketch.total / sketch.count, 3) if sketch.count else None,
+                "max_ms": round(sketch.max, 3) if sketch.max is not None else None,
+            }
+            for q in PERCENTILES:
+                value = sketch.quantile(q)
+                row[f"p{int(q * 100)}_ms"] = round(value, 3) if value is not None else None
+            yield row
+
+    def rates(self):
+        result = {}
+        for name, counters in sorted(self.outcomes.items()):
+            executions = counters["executions"]
+            result[name] = {
+                "executions": executions,
+                "success": counters["success"],
+                "retry": counters["retry"],
+                "failure": counters["failure"],
+                "success_rate": round(counters["success"] / executions, 4) if executions else None,
+                "retry_rate": round(counters["retry"] / executions, 4) if executions else None,
+            }
+        return result
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "groups": [
+                [list(key), self.counts[key], sketch.to_dict()] for key, sketch in self.groups.items()
+            ],
+            "outcomes": {name: dict(counters) for name, counters in self.outcomes.items()},
+            "lines": self.lines,
+            "matched": self.matched,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregate = cls(data["relative_accuracy"])
+        for key, count, sketch in data["groups"]:
+            aggregate.groups[tuple(key)] = LogSketch.from_dict(sketch)
+            aggregate.counts[tuple(key)] = count
+        for name, counters in data["outcomes"].items():
+            aggregate.outcomes[name].update(counters)
+        aggregate.lines = data["lines"]
+        aggregate.matched = data["matched"]
+        return aggregate
+
+
+def _task_outcome(state, result_status):
+    if state == "RETRY":
+        return "retry"
+    if state == "SUCCESS" and not str(result_status or "").startswith("FAILED"):
+        return "success"
+    return "failure"
+
+
+def _parse_event(line, aggregate):
+    """Evento JSON de shared.log_schema (None si la línea no es un evento)"""
+    brace = line.find('{"schema"')
+    if brace == -1:
+        return None
+    try:
+        event = json.loads(line[brace:])
+    except ValueError:
+        return None
+
+    if event.get("event") == "task":
+        status = event.get("result_status") or event.get("status")
+        aggregate.record(
+            "task",
+            event.get("task_name"),
+            status,
+            event.get("duration_ms"),
+            _task_outcome(event.get("status"), event.get("result_status")),
+        )
+        if event.get("queue_wait_ms") is not None:
+            aggregate.record("queue_wait", event.get("task_name"), status, event["queue_wait_ms"])
+        return True
+    if event.get("event") == "http_request":
+        name = f"{event.get('service')} {event.get('method')} {event.get('route') or event.get('path')}"
+        aggregate.record("http", name, event.get("status"), event.get("duration_ms"))
+        return True
+    return None
+
+
+def _parse_text(line, aggregate, service):
+    """Líneas de texto libre del worker y de los servicios"""
+    match = WORKER_SUCCEEDED.search(line)
+    if match:
+        status_match = PAYLOAD_STATUS.search(match.group("payload"))
+        status = status_match.group("status") if status_match else "SUCCESS"
+        aggregate.record(
+            "task",
+            match.group("name"),
+            status,
+            float(match.group("secs")) * 1000,
+            _task_outcome("SUCCESS", status),
+        )
+        return True
+
+    match = WORKER_RETRY.search(line)
+    if match:
+        aggregate.record("task", match.group("name"), "RETRY", None, "retry")
+        return True
+
+    match = WORKER_FAILED.search(line)
+    if match:
+        aggregate.record("task", match.group("name"), "FAILURE", None, "failure")
+        return True
+
+    match = RESPONSE_STATUS.search(line)
+    if match:
+        aggregate.record("http", service or "unknown", match.group("code"))
+        return True
+    return False
+
+
+def parse_line(line, aggregate, service=None, json_only=False):
+    """Actualiza el agregado con una línea de cualquiera de los formatos soportados"""
+    aggregate.lines += 1
+    matched = _parse_event(line, aggregate)
+    if matched is None:
+        matched = False if json_only else _parse_text(line, aggregate, service)
+    if matched:
+        aggregate.matched += 1
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def _service_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def process_file(path, aggregate, offset=0, json_only=False):
+    """
+    Procesa el archivo desde offset y retorna el nuevo offset (solo líneas completas).
+
+    Los .gz no admiten seek: se leen completos y scan los marca como procesados.
+    """
+    service = _service_name(path)
+    if path.endswith(".gz"):
+        with _open(path) as log_file:
+            for line in log_file:
+                parse_line(line, aggregate, service, json_only)
+        return 0
+
+    with open(path, "rb") as log_file:
+        log_file.seek(offset)
+        for raw in log_file:
+            if not raw.endswith(b"\n"):
+                # Línea a medio escribir: se relee en la próxima pasada
+                break
+            parse_line(raw.decode("utf-8", errors="replace"), aggregate, service, json_only)
+            offset += len(raw)
+    return offset
+
+
+def load_state(path):
+    if not path or not os.path.exists(path):
+        return {}, None
+    with open(path, "r", encoding="utf-8") as state_file:
+        state = json.load(state_file)
+    return state.get("offsets", {}), LogAggregate.from_dict(state["aggregate"])
+
+
+def save_state(path, offsets, aggregate):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as state_file:
+        json.dump({"offsets": offsets, "aggregate": aggregate.to_dict()}, state_file)
+    os.replace(tmp_path, path)
+
+
+def _file_id(path):
+    stat = os.stat(path)
+    return f"{stat.st_dev}:{stat.st_ino}"
+
+
+def scan(paths, aggregate, offsets, json_only=False):
+    """
+    Procesa lo nuevo de cada archivo; reinicia el offset si el archivo rotó o se truncó.
+
+    Un .gz ya procesado (mismo file_id y tamaño) se omite en las pasadas siguientes.
+    """
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        previous = offsets.get(path, {})
+        file_id = _file_id(path)
+        size = os.path.getsize(path)
+
+        if path.endswith(".gz"):
+            if previous.get("done") and previous.get("file_id") == file_id and previous.get("size") == size:
+                continue
+            process_file(path, aggregate, 0, json_only)
+            offsets[path] = {"file_id": file_id, "size": size, "done": True}
+            continue
+
+        offset = previous.get("offset", 0)
+        if previous.get("file_id") != file_id or offset > size:
+            offset = 0
+        offsets[path] = {
+            "file_id": file_id,
+            "offset": process_file(path, aggregate, offset, json_only),
+        }
+
+
+def write_report(aggregate, output_format, output=None):
+    stream = open(output, "w", encoding="utf-8", newline="") if output else sys.stdout
+    try:
+        rows = list(aggregate.rows())
+        if output_format == "json":
+            json.dump(
+                {
+                    "lines": aggregate.lines,
+                    "matched": aggregate.matched,
+                    "groups": rows,
+                    "rates": aggregate.rates(),
+                },
+                stream,
+                indent=2,
+            )
+            stream.write("\n")
+        else:
+            fields = ["kind", "name", "status", "count", "mean_ms"] + [
+                f"p{int(q * 100)}_ms" for q in PERCENTILES
+            ] + ["max_ms", "success_rate", "retry_rate"]
+            rates = aggregate.rates()
+            writer = csv.DictWriter(stream, fieldnames=fields)
+            writer.writeheader()
+            for row in rows:
+                rate = rates.get(row["name"], {}) if row["kind"] == "task" else {}
+                writer.writerow({
+                    **row,
+                    "success_rate": rate.get("success_rate"),
+                    "retry_rate": rate.get("retry_rate"),
+                })
+    finally:
+        if output:
+            stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Percentiles y tasas de éxito/reintento desde los logs")
+    parser.add_argument("paths", nargs="+", help="Archivos de log (texto, JSON Lines o .gz)")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv", help="Formato de salida")
+    parser.add_argument("-o", "--output", default=None, help="Archivo de salida (stdout por defecto)")
+    parser.add_argument("--state", default=None, help="Archivo de estado para análisis incremental")
+    parser.add_argument("--follow", action="store_true", help="Seguir los archivos como tail -f")
+    parser.add_argument("--interval", type=float, default=5, help="Segundos entre reportes en --follow")
+    parser.add_argument(
+        "--json-only",
+        action="store_true",
+        help="Ignorar las líneas de texto libre (si el log del worker ya trae los eventos JSON)",
+    )
+    parser.add_argument("--accuracy", type=float, default=0.01, help="Error relativo de los percentiles")
+    args = parser.parse_args()
+
+    offsets, aggregate = load_state(args.state)
+    if aggregate is None:
+        aggregate = LogAggregate(args.accuracy)
+
+    if not args.follow:
+        scan(args.paths, aggregate, offsets, args.json_only)
+        if args.state:
+            save_state(args.state, offsets, aggregate)
+        write_report(aggregate, args.format, args.output)
+        return
+
+    try:
+        while True:
+            scan(args.paths, aggregate, offsets, args.json_only)
+            if args.state:
+                save_state(args.state, offsets, aggregate)
+            write_report(aggregate, args.format, args.output)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Re-despacha las entregas de la dead-letter queue en lotes con límite de tasa.
+
+Uso:
+    python scripts/replay_dlq.py --batch-size 100 --rate 200
+    python scripts/replay_dlq.py --list
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from celery_app.dead_letter import dead_letter_count, peek_dead_letters, replay_dead_letters
+
+TASK_NAME = "logistica.procesar_entrega"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay de la DLQ de procesar_entrega")
+    parser.add_argument("--batch-size", type=int, default=100, help="Entradas por lote")
+    parser.add_argument("--rate", type=float, default=200, help="Máximo de tareas por segundo")
+    parser.add_argument("--max-items", type=int, default=None, help="Máximo de entradas a procesar")
+    parser.add_argument("--list", action="store_true", help="Solo listar las entradas pendientes")
+    args = parser.parse_args()
+
+    if args.list:
+        print(f"Entradas en la DLQ: {dead_letter_count(TASK_NAME)}")
+        for entry in peek_dead_letters(TASK_NAME, args.max_items or 50):
+            print(f"  entrega {entry['args'][0]} - {entry.get('failed_at')} - {entry.get('error')}")
+        return
+
+    from celery_app.dispatcher import LogisticaTasks
+
+    summary = replay_dead_letters(
+        TASK_NAME,
+        LogisticaTasks.redispatch_dead_letters,
+        batch_size=args.batch_size,
+        rate_per_second=args.rate,
+        max_items=args.max_items,
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,17 @@
-from functools import wraps
+from functools import lru_cache, wraps
 import os
+import re
+from typing import List, NamedTuple, Optional, Union
 from flask import current_app, g, request
 from flask_jwt_extended import get_jwt, verify_jwt_in_request
+import base64
 import bcrypt
 import hashlib
 import hmac
 import json
 import secrets
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import padding as crypto_padding
 import logging
@@ -49,58 +53,158 @@ def validate_signature(secret_key: str, data: dict, signature: str) -> bool:
     return hmac.compare_digest(expected_signature, signature)
 
 
+def validate_signatures(secret_key: str, items: list) -> list:
+    """
+    Validate many (data, signature) pairs with the same shared secret key (HMAC).
+    The keyed HMAC state is built once and copied for every item.
+    A signature that is not a string is reported as invalid instead of
+    failing the whole batch.
+    """
+    base_hmac = hmac.new(secret_key.encode("utf-8"), digestmod=hashlib.sha512)
+    results = []
+    for data, signature in items:
+        if not isinstance(signature, str):
+            results.append(False)
+            continue
+        mac = base_hmac.copy()
+        mac.update(json.dumps(data, sort_keys=True).encode("utf-8"))
+        # Comparar bytes: compare_digest rechaza str con caracteres no ASCII
+        results.append(hmac.compare_digest(mac.hexdigest().encode("utf-8"), signature.encode("utf-8")))
+    logger.info(f"🔏 {len(items)} data signatures validated")
+    return results
+
+
 # --- Encryption Utilities ---
-from typing import Union
+# Formato de escritura: "v2" (AES-GCM, base64) o "v1" (legacy AES-CBC, hex "iv:ciphertext")
+FIELD_ENCRYPTION_FORMAT = os.getenv("FIELD_ENCRYPTION_FORMAT", "v2")
+GCM_PREFIX = "v2:"
+# Legacy: IV de 16 bytes y ciphertext en bloques de 16 bytes, ambos en hex
+LEGACY_CIPHERTEXT = re.compile(r"[0-9a-f]{32}:(?:[0-9a-f]{32})+")
 
 
-def encrypt(obj: Union[dict, str], encryption_key: str = "default") -> str:
-    """Encrypt text using AES-256."""
-    text = json.dumps(obj) if isinstance(obj, dict) else obj
+class _KeyMaterial(NamedTuple):
+    cbc: algorithms.AES
+    gcm: AESGCM
 
-    if not text:
-        return text
 
-    loaded_key = current_app.config.get("PRIVATE_KEY", "default")
+@lru_cache(maxsize=8)
+def _derive_key(loaded_key: str) -> _KeyMaterial:
+    """Derive the AES-256 key from the configured key material (cached per key).
 
+    The cache is keyed on the key material itself, so rotating PRIVATE_KEY
+    derives a new key automatically and the LRU bound evicts old ones.
+    """
     key = hashlib.sha256(loaded_key.encode("utf-8")).digest()
+    return _KeyMaterial(cbc=algorithms.AES(key), gcm=AESGCM(key))
+
+
+def _current_key() -> _KeyMaterial:
+    return _derive_key(current_app.config.get("PRIVATE_KEY", "default"))
+
+
+def is_legacy_ciphertext(value: Optional[str]) -> bool:
+    """True if the value uses the legacy hex AES-CBC "iv:ciphertext" format."""
+    return bool(value) and LEGACY_CIPHERTEXT.fullmatch(value) is not None
+
+
+def _encrypt_text(key: _KeyMaterial, text: str) -> str:
+    if FIELD_ENCRYPTION_FORMAT == "v1":
+        return _encrypt_text_cbc(key.cbc, text)
+    # Envelope v2: "v2:" + base64(nonce[12] + ciphertext + tag[16])
+    nonce = secrets.token_bytes(12)
+    encrypted = key.gcm.encrypt(nonce, text.encode("utf-8"), None)
+    return GCM_PREFIX + base64.b64encode(nonce + encrypted).decode("ascii")
+
+
+def _encrypt_text_cbc(algorithm: algorithms.AES, text: str) -> str:
     iv = secrets.token_bytes(16)
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
+    encryptor = Cipher(algorithm, modes.CBC(iv), backend=default_backend()).encryptor()
 
     padder = crypto_padding.PKCS7(128).padder()
     padded_text = padder.update(text.encode("utf-8")) + padder.finalize()
     encrypted = encryptor.update(padded_text) + encryptor.finalize()
-    logger.info("🔒 Data encrypted")
     return f"{iv.hex()}:{encrypted.hex()}"
 
 
-def decrypt(encrypted_text: str, encryption_key: str = "default") -> Union[dict, str]:
-    """Decrypt text using AES-256."""
-
-    if not encrypted_text:
-        return {}
-
-    loaded_key = current_app.config.get("PRIVATE_KEY", "default")
+def _decrypt_raw(key: _KeyMaterial, encrypted_text: str) -> str:
+    if encrypted_text.startswith(GCM_PREFIX):
+        envelope = base64.b64decode(encrypted_text[len(GCM_PREFIX):])
+        return key.gcm.decrypt(envelope[:12], envelope[12:], None).decode("utf-8")
 
-    key = hashlib.sha256(loaded_key.encode("utf-8")).digest()
     iv_hex, encrypted_hex = encrypted_text.split(":")
     iv = bytes.fromhex(iv_hex)
     encrypted = bytes.fromhex(encrypted_hex)
 
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    decryptor = cipher.decryptor()
+    decryptor = Cipher(key.cbc, modes.CBC(iv), backend=default_backend()).decryptor()
 
     unpadder = crypto_padding.PKCS7(128).unpadder()
     decrypted_padded = decryptor.update(encrypted) + decryptor.finalize()
     decrypted = unpadder.update(decrypted_padded) + unpadder.finalize()
-    decoded_decrypted = decrypted.decode("utf-8")
-    logger.info("🔓 Data decrypted")
+    return decrypted.decode("utf-8")
+
+
+def _decrypt_text(key: _KeyMaterial, encrypted_text: str) -> Union[dict, str]:
+    decoded_decrypted = _decrypt_raw(key, encrypted_text)
     try:
         return json.loads(decoded_decrypted)
     except json.JSONDecodeError:
         return decoded_decrypted
 
 
+def reencrypt_many(encrypted_texts: List[Optional[str]]) -> List[Optional[str]]:
+    """Re-encrypt legacy values with the current format. Other values are returned as-is."""
+    key = _current_key()
+    return [
+        _encrypt_text(key, _decrypt_raw(key, value)) if is_legacy_ciphertext(value) else value
+        for value in encrypted_texts
+    ]
+
+
+def encrypt(obj: Union[dict, str], encryption_key: str = "default") -> str:
+    """Encrypt text using AES-256 (GCM envelope unless FIELD_ENCRYPTION_FORMAT=v1)."""
+    text = json.dumps(obj) if isinstance(obj, dict) else obj
+
+    if not text:
+        return text
+
+    encrypted = _encrypt_text(_current_key(), text)
+    logger.info("🔒 Data encrypted")
+    return encrypted
+
+
+def decrypt(encrypted_text: str, encryption_key: str = "default") -> Union[dict, str]:
+    """Decrypt text using AES-256. Reads both the GCM envelope and the legacy CBC format."""
+
+    if not encrypted_text:
+        return {}
+
+    decrypted = _decrypt_text(_current_key(), encrypted_text)
+    logger.info("🔓 Data decrypted")
+    return decrypted
+
+
+def encrypt_many(objs: List[Optional[Union[dict, str]]]) -> List[Optional[str]]:
+    """Encrypt several values with a single key lookup. Empty values are returned as-is."""
+    key = _current_key()
+    results = []
+    for obj in objs:
+        text = json.dumps(obj) if isinstance(obj, dict) else obj
+        results.append(_encrypt_text(key, text) if text else text)
+    logger.info(f"🔒 {len(objs)} values encrypted")
+    return results
+
+
+def decrypt_many(encrypted_texts: List[Optional[str]]) -> List[Union[dict, str, None]]:
+    """Decrypt several values with a single key lookup. Empty values decrypt to None."""
+    key = _current_key()
+    results = [
+        _decrypt_text(key, encrypted_text) if encrypted_text else None
+        for encrypted_text in encrypted_texts
+    ]
+    logger.info(f"🔓 {len(encrypted_texts)} values decrypted")
+    return results
+
+
 # --- Flask Context Utilities ---
 def with_app_context(app):
     """Decorator to run a function within the Flask app context."""
@@ -116,17 +220,62 @@ def with_app_context(app):
     return decorator
 
 
-def required_signed_celery_message(kwargs):
-    """Validate that the kwargs contain a valid signed_celery_message."""
+def _celery_message_bytes(task_name: str, args) -> bytes:
+    """Canonical bytes of a Celery message envelope (task name + positional args)."""
+    return json.dumps(
+        {"task_name": task_name, "args": list(args)},
+        sort_keys=True,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def sign_celery_messages(task_name: str, list_of_args: list) -> list:
+    """
+    Sign many Celery messages of the same task with CELERY_SIGNING_KEY.
+    The signature is the base64url HMAC-SHA512 digest over the canonical envelope,
+    so the message carries a single copy of the args.
+    """
+    base_hmac = hmac.new(
+        os.getenv("CELERY_SIGNING_KEY", "").encode("utf-8"), digestmod=hashlib.sha512
+    )
+    signatures = []
+    for args in list_of_args:
+        mac = base_hmac.copy()
+        mac.update(_celery_message_bytes(task_name, args))
+        signatures.append(base64.urlsafe_b64encode(mac.digest()).rstrip(b"=").decode("ascii"))
+    return signatures
+
+
+def sign_celery_message(task_name: str, args) -> str:
+    """Sign a single Celery message envelope."""
+    return sign_celery_messages(task_name, [args])[0]
+
+
+def required_signed_celery_message(kwargs, task_name: Optional[str] = None, args=None):
+    """Validate that the kwargs contain a valid signed_celery_message.
+
+    Compact messages are verified against the task name and the positional args
+    the worker actually received. Legacy messages that still carry
+    info_internal are verified against that copy.
+    """
     signed_message = kwargs.get("signed_celery_message", None)
     if not signed_message:
         raise ValueError("signed_celery_message is required in kwargs")
 
-    is_valid = validate_signature(
-        os.getenv("CELERY_SIGNING_KEY", ""),
-        kwargs.get("info_internal", {}),
-        signed_message,
-    )
+    if "info_internal" in kwargs:
+        is_valid = validate_signature(
+            os.getenv("CELERY_SIGNING_KEY", ""),
+            kwargs.get("info_internal", {}),
+            signed_message,
+        )
+        if is_valid and task_name is not None:
+            info = kwargs["info_internal"]
+            is_valid = info.get("task_name") == task_name and list(info.get("args", [])) == list(args or [])
+    else:
+        if task_name is None:
+            raise ValueError("task_name is required to validate a compact signed_celery_message")
+        expected_signature = sign_celery_message(task_name, args or [])
+        is_valid = hmac.compare_digest(expected_signature, signed_message)
 
     if not is_valid:
         raise ValueError("Invalid signed_celery_message")
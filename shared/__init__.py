@@ -3,10 +3,88 @@ Configuración compartida para microservicios Flask
 Este módulo proporciona funciones reutilizables para configurar Flask
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, jsonify
 import logging
 import os
 
+from .metrics import setup_metrics
+from .request_logging import setup_request_logging
+
+# Perfil de almacenamiento SQLite: "performance" (WAL, synchronous=NORMAL, mmap,
+# caché de páginas) o "default" (configuración de fábrica de SQLite)
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "performance")
+
+_sqlite_listener_registered = False
+
+
+def sqlite_pragmas():
+    """
+    PRAGMAs aplicados a cada conexión SQLite según SQLITE_PROFILE.
+    Cada valor se puede ajustar por separado con su variable de entorno.
+    """
+    pragmas = {"busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))}
+    if SQLITE_PROFILE == "performance":
+        pragmas.update({
+            "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+            "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+            "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+            # Negativo = tamaño en KiB (64 MiB)
+            "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+            "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+        })
+    return pragmas
+
+
+def _register_sqlite_listener():
+    """Aplica los PRAGMAs del perfil a cada conexión SQLite nueva del pool"""
+    global _sqlite_listener_registered
+    if _sqlite_listener_registered:
+        return
+
+    import sqlite3
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(Engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    _sqlite_listener_registered = True
+
+
+def engine_options(db_uri):
+    """
+    Opciones del engine de SQLAlchemy (pool de conexiones) configurables por entorno.
+    """
+    options = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+    }
+    is_memory = db_uri.startswith("sqlite") and (":memory:" in db_uri or db_uri in ("sqlite://", "sqlite:///"))
+    if not is_memory:
+        options.update({
+            "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        })
+    if db_uri.startswith("sqlite"):
+        # Esperar el lock de escritura en lugar de fallar con "database is locked"
+        options["connect_args"] = {
+            "timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")) / 1000,
+            "check_same_thread": False,
+        }
+    return options
+
+
 def create_app(service_name="microservice", config_overrides=None):
     """
     Crear una aplicación Flask genérica que puede ser usada por cualquier microservicio
@@ -21,43 +99,20 @@ def create_app(service_name="microservice", config_overrides=None):
     app = Flask(__name__)
     # Configure logging
     logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(service_name)
-
-    # Log incoming requests
-    @app.before_request
-    def log_request():
-        logger.info(f"Incoming request: {request.method} {request.path}")
-        content_type = request.content_type
-
-        if content_type and "application/json" in content_type:  # Check if Content-Type is JSON
-            try:
-                logger.info(f"Payload: {request.get_json()}")
-            except Exception as e:
-                logger.warning(f"Failed to parse JSON payload: {e}")
-        elif request.form:  # Handle form data
-            logger.info(f"Form data: {request.form}")
-        elif request.args:  # Handle query parameters
-            logger.info(f"Query params: {request.args}")
-        else:
-            logger.info("No JSON payload or form data found in the request.")
-
-    # Log outgoing responses
-    @app.after_request
-    def log_response(response):
-        logger.info(f"Response status: {response.status}")
-        try:
-            if response.is_json:  # Check if the response is JSON
-                logger.info(f"Response JSON: {response.get_json()}")
-            else:
-                logger.info("Response is not JSON.")
-        except Exception as e:
-            logger.warning(f"Failed to log response body: {e}")
-        return response
+
+    # Log de requests/responses: asíncrono, muestreado y con redacción de campos
+    setup_request_logging(app, service_name)
+
+    # Contadores y latencia de requests, expuestos en GET /metrics (formato Prometheus)
+    setup_metrics(app, service_name)
 
     # Configuración de base de datos
     db_uri = os.getenv("SQLALCHEMY_DATABASE_URI", "sqlite:///misw4202.db")
     app.config["SQLALCHEMY_DATABASE_URI"] = db_uri
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(db_uri)
+    if db_uri.startswith("sqlite"):
+        _register_sqlite_listener()
 
     # Configuración JWT
     app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "frase-secreta")
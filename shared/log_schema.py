@@ -0,0 +1,74 @@
+"""
+Esquema de eventos de log estructurados (una línea JSON por request o tarea)
+
+Todos los servicios Flask y el worker de Celery emiten los mismos campos para
+que el análisis lea columnas en lugar de parsear texto libre:
+
+    schema, ts, event ("http_request" | "task"), service, request_id,
+    route, method, path, status, duration_ms, queue_wait_ms, task_id,
+    task_name, retries
+
+Los campos que no aplican a un tipo de evento van en null. El request_id
+viaja entre servicios en el header X-Request-ID y hacia el worker en los
+headers del mensaje de Celery.
+"""
+
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, has_request_context
+
+LOG_SCHEMA_VERSION = 1
+REQUEST_ID_HEADER = "X-Request-ID"
+
+EVENT_FIELDS = (
+    "schema",
+    "ts",
+    "event",
+    "service",
+    "request_id",
+    "route",
+    "method",
+    "path",
+    "status",
+    "duration_ms",
+    "queue_wait_ms",
+    "task_id",
+    "task_name",
+    "retries",
+)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_request_id():
+    """request_id del request Flask en curso (None fuera de un request)"""
+    if has_request_context():
+        return g.get("request_id")
+    return None
+
+
+def note_task_id(task_id) -> None:
+    """Asocia al request en curso el id de la tarea que despachó"""
+    if has_request_context() and task_id:
+        g.task_id = task_id
+
+
+def trace_headers() -> dict:
+    """Headers del mensaje de Celery para correlación y tiempo en cola"""
+    return {"request_id": current_request_id(), "sent_at": time.time()}
+
+
+def build_event(event: str, **fields) -> dict:
+    """Evento con todos los campos del esquema en orden estable (extras al final)"""
+    record = dict.fromkeys(EVENT_FIELDS)
+    record.update(
+        schema=LOG_SCHEMA_VERSION,
+        ts=datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        event=event,
+    )
+    record.update(fields)
+    return record
@@ -0,0 +1,424 @@
+"""
+Métricas en proceso de bajo costo (contadores, histogramas y gauges)
+
+Registrar una observación es un bisect sobre los límites de los buckets y
+tres sumas bajo un lock por métrica; no hay I/O en el camino del request
+ni de la tarea. render_prometheus las expone en el formato de texto de
+Prometheus (setup_metrics agrega GET /metrics a cada servicio Flask).
+
+Los procesos del worker (prefork) no comparten memoria, así que cada uno
+vuelca periódicamente a Redis el delta de sus contadores e histogramas
+(flush_if_due) y cualquier servicio puede leer el agregado de todos los
+procesos con load_from_redis.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2000, 5000, 10000, 30000)
+
+METRICS_PREFIX = "metrics:"
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+
+class Counter:
+    """Contador monotónico con labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, description="", labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._series[labelvalues] = self._series.get(labelvalues, 0) + amount
+
+    def add_series(self, series):
+        with self._lock:
+            for labels, value in series.items():
+                self._series[labels] = self._series.get(labels, 0) + value
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            series = dict(self._series)
+            if reset:
+                self._series = {}
+        return series
+
+
+class Gauge:
+    """Gauge calculado al momento de exponerlo (ej: profundidad de colas)"""
+
+    kind = "gauge"
+
+    def __init__(self, name, description="", labelnames=(), callback=None):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def snapshot(self, reset=False):
+        try:
+            return dict(self.callback()) if self.callback else {}
+        except Exception as e:
+            logger.warning(f"No se pudo calcular el gauge {self.name}: {e}")
+            return {}
+
+
+class Histogram:
+    """Histograma con buckets fijos (semántica 'le' acumulable) y labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name, description="", buckets=DEFAULT_BUCKETS_MS, labelnames=()):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _new_series(self):
+        # [conteo por bucket (+Inf al final), suma, conteo]
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = self._new_series()
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        """Registra en milisegundos la duración del bloque"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe((time.perf_counter() - started) * 1000, *labelvalues)
+
+    def add_series(self, series):
+        """Suma series de un snapshot (ej: un delta que no se pudo volcar)"""
+        with self._lock:
+            for labels, (counts, total, count) in series.items():
+                current = self._series.setdefault(labels, self._new_series())
+                current[0] = [a + b for a, b in zip(current[0], counts)]
+                current[1] += total
+                current[2] += count
+
+    def snapshot(self, reset=False):
+        """Copia de las series {labels: (counts, sum, count)}; con reset vacía el histograma"""
+        with self._lock:
+            series = {
+                labels: (list(counts), total, count)
+                for labels, (counts, total, count) in self._series.items()
+            }
+            if reset:
+                self._series = {}
+        return series
+
+
+def merge_series(*snapshots):
+    """Suma snapshots de series del mismo histograma"""
+    merged = {}
+    for snapshot in snapshots:
+        for labels, (counts, total, count) in snapshot.items():
+            if labels not in merged:
+                merged[labels] = ([0] * len(counts), 0.0, 0)
+            m_counts, m_total, m_count = merged[labels]
+            merged[labels] = (
+                [a + b for a, b in zip(m_counts, counts)],
+                m_total + total,
+                m_count + count,
+            )
+    return merged
+
+
+def estimate_quantile(buckets, counts, q):
+    """Cuantil por interpolación lineal dentro del bucket (como histogram_quantile)"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(counts):
+        if seen + count >= rank and count:
+            if index >= len(buckets):
+                return buckets[-1]
+            lower = buckets[index - 1] if index > 0 else 0.0
+            return lower + (buckets[index] - lower) * (rank - seen) / count
+        seen += count
+    return buckets[-1]
+
+
+def summarize(histogram, series):
+    """Resumen legible (conteo, media, p50/p90/p99) por combinación de labels"""
+    result = {}
+    for labels, (counts, total, count) in sorted(series.items()):
+        key = ",".join(str(value) for value in labels) or "total"
+        result[key] = {
+            "count": count,
+            "mean_ms": round(total / count, 3) if count else None,
+            "p50_ms": _round(estimate_quantile(histogram.buckets, counts, 0.5)),
+            "p90_ms": _round(estimate_quantile(histogram.buckets, counts, 0.9)),
+            "p99_ms": _round(estimate_quantile(histogram.buckets, counts, 0.99)),
+            "buckets": dict(zip([str(b) for b in histogram.buckets] + ["+Inf"], counts)),
+        }
+    return result
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name, factory):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+    def histogram(self, name, description="", buckets=DEFAULT_BUCKETS_MS, labelnames=()):
+        return self._get_or_create(name, lambda: Histogram(name, description, buckets, labelnames))
+
+    def counter(self, name, description="", labelnames=()):
+        return self._get_or_create(name, lambda: Counter(name, description, labelnames))
+
+    def gauge(self, name, description="", labelnames=(), callback=None):
+        return self._get_or_create(name, lambda: Gauge(name, description, labelnames, callback))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def metrics(self):
+        return list(self._metrics.values())
+
+
+REGISTRY = MetricsRegistry()
+
+
+def histogram(name, description="", buckets=DEFAULT_BUCKETS_MS, labelnames=()):
+    return REGISTRY.histogram(name, description, buckets, labelnames)
+
+
+def counter(name, description="", labelnames=()):
+    return REGISTRY.counter(name, description, labelnames)
+
+
+def gauge(name, description="", labelnames=(), callback=None):
+    return REGISTRY.gauge(name, description, labelnames, callback)
+
+
+# --- Formato de texto de Prometheus ---
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(entries):
+    """
+    Texto de exposición para [(métrica, series)], donde series es el
+    snapshot de la métrica (local, de Redis o una combinación)
+    """
+    lines = []
+    for metric, series in entries:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels, value in sorted(series.items()):
+            if metric.kind == "histogram":
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(list(metric.buckets) + [float("inf")], counts):
+                    cumulative += bucket_count
+                    le = _labels_text(metric.labelnames, labels, [("le", _number(float(bound)))])
+                    lines.append(f"{metric.name}_bucket{le} {cumulative}")
+                label_text = _labels_text(metric.labelnames, labels)
+                lines.append(f"{metric.name}_sum{label_text} {_number(float(total))}")
+                lines.append(f"{metric.name}_count{label_text} {count}")
+            else:
+                lines.append(f"{metric.name}{_labels_text(metric.labelnames, labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def render_registry(registry=None, source="local"):
+    """
+    Expone el registro. source='local' usa la memoria del proceso (servicios
+    Flask); source='redis' usa el agregado volcado por los procesos del worker.
+    Los gauges siempre se calculan al momento.
+    """
+    registry = registry or REGISTRY
+    entries = []
+    for metric in registry.metrics():
+        if source == "redis" and metric.kind != "gauge":
+            series = load_from_redis(metric)
+        else:
+            series = metric.snapshot()
+        entries.append((metric, series))
+    return render_prometheus(entries)
+
+
+def setup_metrics(app, service_name):
+    """Registra contadores/latencia de requests HTTP y el endpoint GET /metrics"""
+    from flask import Response, g, request
+
+    requests_total = counter(
+        "http_requests_total",
+        "Requests HTTP atendidos",
+        labelnames=("service", "method", "route", "status"),
+    )
+    request_duration = histogram(
+        "http_request_duration_ms",
+        "Latencia de los requests HTTP (ms)",
+        labelnames=("service", "method", "route"),
+    )
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get("metrics_started")
+        if started is not None:
+            # La regla de la ruta (no el path) mantiene acotada la cardinalidad
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            requests_total.inc(service_name, request.method, route, str(response.status_code))
+            request_duration.observe(
+                (time.perf_counter() - started) * 1000, service_name, request.method, route
+            )
+        return response
+
+    @app.route("/metrics")
+    def prometheus_metrics():
+        return Response(render_registry(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+# --- Agregación entre procesos vía Redis ---
+
+_redis_client = None
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def _redis():
+    global _redis_client
+    if _redis_client is None:
+        import redis
+
+        _redis_client = redis.Redis.from_url(
+            os.getenv("METRICS_REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")),
+            decode_responses=True,
+        )
+    return _redis_client
+
+
+def flush_to_redis(registry=REGISTRY):
+    """Suma a Redis el delta de contadores e histogramas y los reinicia"""
+    client = _redis()
+    pipe = client.pipeline(transaction=False)
+    pending = {}
+    for metric in registry.metrics():
+        if metric.kind == "gauge":
+            continue
+        series = metric.snapshot(reset=True)
+        if not series:
+            continue
+        pending[metric] = series
+        key = f"{METRICS_PREFIX}{metric.name}"
+        for labels, value in series.items():
+            field = json.dumps(list(labels))
+            if metric.kind == "counter":
+                pipe.hincrbyfloat(key, f"{field}|value", value)
+                continue
+            counts, total, count = value
+            for index, bucket_count in enumerate(counts):
+                if bucket_count:
+                    pipe.hincrby(key, f"{field}|{index}", bucket_count)
+            pipe.hincrbyfloat(key, f"{field}|sum", total)
+            pipe.hincrby(key, f"{field}|count", count)
+    if not pending:
+        return
+    try:
+        pipe.execute()
+    except Exception:
+        # Devolver el delta al histograma para el próximo intento
+        for metric, series in pending.items():
+            metric.add_series(series)
+        raise
+
+
+def flush_if_due(*registries):
+    """Vuelca a Redis los registros (REGISTRY por defecto) si pasó METRICS_FLUSH_INTERVAL"""
+    global _last_flush
+    now = time.monotonic()
+    if now - _last_flush < METRICS_FLUSH_INTERVAL:
+        return
+    with _flush_lock:
+        if now - _last_flush < METRICS_FLUSH_INTERVAL:
+            return
+        _last_flush = now
+        for registry in registries or (REGISTRY,):
+            try:
+                flush_to_redis(registry)
+            except Exception as e:
+                logger.warning(f"No se pudieron volcar las métricas a Redis: {e}")
+
+
+def load_from_redis(metric):
+    """Series agregadas en Redis por todos los procesos para la métrica dada"""
+    raw = _redis().hgetall(f"{METRICS_PREFIX}{metric.name}")
+    series = {}
+    for field, value in raw.items():
+        labels_json, _, part = field.rpartition("|")
+        labels = tuple(json.loads(labels_json))
+        if metric.kind == "counter":
+            series[labels] = float(value)
+            continue
+        counts, total, count = series.get(labels, ([0] * (len(metric.buckets) + 1), 0.0, 0))
+        if part == "sum":
+            total = float(value)
+        elif part == "count":
+            count = int(value)
+        else:
+            counts[int(part)] = int(value)
+        series[labels] = (counts, total, count)
+    return series
@@ -0,0 +1,224 @@
+"""
+Log de requests/responses asíncrono y muestreado para los microservicios Flask
+
+El hilo del request solo arma un evento liviano (método, ruta, estado,
+duración y, si aplica, referencias a los cuerpos) y lo encola sin bloquear.
+Un QueueListener en un hilo aparte aplica la redacción/truncado, serializa a
+JSON (esquema de shared.log_schema) y escribe en los handlers reales. Si la
+cola se llena el evento se descarta y se cuenta en lugar de frenar el request.
+
+Configuración (variables de entorno):
+    REQUEST_LOG_MODE          async | sync | off
+    REQUEST_LOG_SAMPLE_RATE   fracción de requests registrados (los errores >= 500 siempre)
+    REQUEST_LOG_BODY_RATE     fracción de los requests registrados que incluyen cuerpos
+    REQUEST_LOG_BODY_ROUTES   prefijos de ruta separados por coma cuyos cuerpos se registran ("*" = todas)
+    REQUEST_LOG_MAX_FIELD     largo máximo de cada string del cuerpo antes de truncar
+    REQUEST_LOG_REDACT        campos cuyo valor nunca se escribe
+    REQUEST_LOG_QUEUE_SIZE    capacidad de la cola
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, request
+
+from .log_schema import REQUEST_ID_HEADER, build_event, new_request_id
+
+REQUEST_LOG_MODE = os.getenv("REQUEST_LOG_MODE", "async")
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "1.0"))
+REQUEST_LOG_BODY_RATE = float(os.getenv("REQUEST_LOG_BODY_RATE", "0.01"))
+REQUEST_LOG_BODY_ROUTES = tuple(
+    route.strip() for route in os.getenv("REQUEST_LOG_BODY_ROUTES", "").split(",") if route.strip()
+)
+REQUEST_LOG_MAX_FIELD = int(os.getenv("REQUEST_LOG_MAX_FIELD", "256"))
+REQUEST_LOG_REDACT = frozenset(
+    field.strip()
+    for field in os.getenv(
+        "REQUEST_LOG_REDACT",
+        "firma_recibe,firma_payload,firma,signature,contrasena,password,token,i-api-key",
+    ).split(",")
+    if field.strip()
+)
+REQUEST_LOG_QUEUE_SIZE = int(os.getenv("REQUEST_LOG_QUEUE_SIZE", "10000"))
+
+
+def sanitize(value, max_field=REQUEST_LOG_MAX_FIELD, redact=REQUEST_LOG_REDACT):
+    """Copia del cuerpo con campos sensibles redactados y strings largos truncados"""
+    if isinstance(value, dict):
+        return {
+            key: (
+                f"[REDACTED {len(str(item))}B]" if key in redact and item is not None
+                else sanitize(item, max_field, redact)
+            )
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [sanitize(item, max_field, redact) for item in value]
+    if isinstance(value, str) and len(value) > max_field:
+        return f"{value[:max_field]}...(+{len(value) - max_field})"
+    return value
+
+
+class RequestLogFormatter(logging.Formatter):
+    """Serializa el evento del request a una línea JSON (se ejecuta en el hilo del listener)"""
+
+    def format(self, record):
+        event = getattr(record, "event", None)
+        if event is None:
+            return super().format(record)
+        for field in ("body", "response"):
+            if field in event:
+                event[field] = sanitize(event[field])
+        return json.dumps(event, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler que descarta (y cuenta) en lugar de bloquear si la cola está llena"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # El formateo se difiere al hilo del listener
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AsyncRequestLogger:
+    """Logger de requests con cola y listener iniciados por proceso"""
+
+    def __init__(self, service_name, mode=REQUEST_LOG_MODE):
+        self.service_name = service_name
+        self.mode = mode
+        self.logger = logging.getLogger(f"{service_name}.requests")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+        self._output = logging.StreamHandler()
+        self._output.setFormatter(RequestLogFormatter())
+
+        self._handler = None
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        if mode == "sync":
+            self.logger.addHandler(self._output)
+
+    def _ensure_listener(self):
+        # El hilo del listener no sobrevive a un fork (reloader, gunicorn)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._handler is not None:
+                self.logger.removeHandler(self._handler)
+            log_queue = queue.Queue(maxsize=REQUEST_LOG_QUEUE_SIZE)
+            self._handler = NonBlockingQueueHandler(log_queue)
+            self._listener = QueueListener(log_queue, self._output, respect_handler_level=False)
+            self._listener.start()
+            self.logger.addHandler(self._handler)
+            self._pid = os.getpid()
+
+    def emit(self, event):
+        if self.mode == "off":
+            return
+        if self.mode == "async":
+            self._ensure_listener()
+        self.logger.info("request", extra={"event": event})
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "dropped": self._handler.dropped if self._handler else 0,
+            "pending": self._handler.queue.qsize() if self._handler else 0,
+        }
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+
+
+def _log_body_for(path):
+    if not REQUEST_LOG_BODY_ROUTES:
+        return False
+    return "*" in REQUEST_LOG_BODY_ROUTES or path.startswith(REQUEST_LOG_BODY_ROUTES)
+
+
+def setup_request_logging(app, service_name):
+    """Registra los hooks before/after_request que alimentan el logger asíncrono"""
+    request_logger = AsyncRequestLogger(service_name)
+    app.extensions["request_logger"] = request_logger
+
+    @app.before_request
+    def assign_request_id():
+        # Reutilizar el id del gateway/servicio que llama para correlacionar
+        g.request_id = request.headers.get(REQUEST_ID_HEADER) or new_request_id()
+        g.request_log_started = time.perf_counter()
+
+    @app.after_request
+    def return_request_id(response):
+        if g.get("request_id"):
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
+
+    if request_logger.mode == "off":
+        return request_logger
+
+    @app.before_request
+    def start_request_log():
+        g.request_log_sampled = random.random() < REQUEST_LOG_SAMPLE_RATE
+        g.request_log_body = (
+            g.request_log_sampled
+            and _log_body_for(request.path)
+            and random.random() < REQUEST_LOG_BODY_RATE
+        )
+
+    @app.after_request
+    def end_request_log(response):
+        started = g.get("request_log_started")
+        if started is None:
+            return response
+        if not g.get("request_log_sampled") and response.status_code < 500:
+            return response
+
+        event = build_event(
+            "http_request",
+            service=service_name,
+            request_id=g.get("request_id"),
+            route=request.url_rule.rule if request.url_rule else None,
+            method=request.method,
+            path=request.path,
+            status=response.status_code,
+            duration_ms=round((time.perf_counter() - started) * 1000, 3),
+            task_id=g.get("task_id"),
+            request_bytes=request.content_length,
+            response_bytes=response.calculate_content_length(),
+        )
+        if g.get("request_log_body") or (
+            response.status_code >= 400 and _log_body_for(request.path)
+        ):
+            if request.is_json:
+                event["body"] = request.get_json(silent=True)
+            elif request.args:
+                event["body"] = request.args.to_dict()
+            if response.is_json and not response.is_streamed:
+                event["response"] = response.get_json(silent=True)
+
+        request_logger.emit(event)
+        return response
+
+    return request_logger
@@ -0,0 +1,106 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+flask = pytest.importorskip("flask")
+pytest.importorskip("flask_jwt_extended")
+pytest.importorskip("bcrypt")
+pytest.importorskip("cryptography")
+
+from scripts import utils
+from scripts.utils import (
+    GCM_PREFIX,
+    decrypt,
+    decrypt_many,
+    encrypt,
+    encrypt_many,
+    is_legacy_ciphertext,
+    reencrypt_many,
+)
+
+
+@pytest.fixture(autouse=True)
+def app_context():
+    app = flask.Flask(__name__)
+    app.config["PRIVATE_KEY"] = "llave-de-prueba"
+    with app.app_context():
+        yield app
+
+
+def _legacy(text):
+    return utils._encrypt_text_cbc(utils._current_key().cbc, text)
+
+
+def test_v2_ida_y_vuelta():
+    cifrado = encrypt("Calle 5 # 10-20")
+
+    assert cifrado.startswith(GCM_PREFIX)
+    assert not is_legacy_ciphertext(cifrado)
+    assert decrypt(cifrado) == "Calle 5 # 10-20"
+
+
+def test_v2_dict_y_lote():
+    cifrados = encrypt_many([{"firma": "abc"}, "Juan", None, ""])
+
+    assert cifrados[2] is None and cifrados[3] == ""
+    assert decrypt_many(cifrados) == [{"firma": "abc"}, "Juan", None, None]
+
+
+def test_v2_detecta_manipulacion():
+    cifrado = encrypt("Juan")
+    envelope = bytearray(utils.base64.b64decode(cifrado[len(GCM_PREFIX):]))
+    envelope[-1] ^= 1
+    manipulado = GCM_PREFIX + utils.base64.b64encode(bytes(envelope)).decode("ascii")
+
+    with pytest.raises(Exception):
+        decrypt(manipulado)
+
+
+def test_lee_legacy_cbc():
+    legacy = _legacy("Calle 5: apto 2")
+
+    assert is_legacy_ciphertext(legacy)
+    assert decrypt(legacy) == "Calle 5: apto 2"
+
+
+def test_formato_v1_sigue_escribiendo_cbc(monkeypatch):
+    monkeypatch.setattr(utils, "FIELD_ENCRYPTION_FORMAT", "v1")
+    cifrado = encrypt("Juan")
+
+    assert is_legacy_ciphertext(cifrado)
+    assert decrypt(cifrado) == "Juan"
+
+
+def test_texto_plano_con_dos_puntos_no_es_legacy():
+    assert not is_legacy_ciphertext("Calle 5: apto 2")
+    assert not is_legacy_ciphertext("ab:cd")
+    assert not is_legacy_ciphertext(None)
+    assert not is_legacy_ciphertext("")
+
+
+def test_reencrypt_many_solo_migra_legacy():
+    legacy = _legacy("Juan")
+    v2 = encrypt("Ana")
+
+    migrados = reencrypt_many([legacy, v2, "Calle 5: apto 2", None])
+
+    assert migrados[0].startswith(GCM_PREFIX)
+    assert decrypt(migrados[0]) == "Juan"
+    assert migrados[1:] == [v2, "Calle 5: apto 2", None]
+
+
+def test_reencrypt_many_legacy_corrupto_falla_con_value_error():
+    # Bloque sin padding PKCS7 válido: mismo formato hex, no descifrable
+    iv = bytes(16)
+    encryptor = utils.Cipher(
+        utils._current_key().cbc, utils.modes.CBC(iv), backend=utils.default_backend()
+    ).encryptor()
+    corrupto = f"{iv.hex()}:{(encryptor.update(bytes(16)) + encryptor.finalize()).hex()}"
+
+    assert is_legacy_ciphertext(corrupto)
+    # reencriptar_entregas omite la fila en lugar de abortar la migración
+    with pytest.raises(ValueError):
+        reencrypt_many([corrupto])
@@ -0,0 +1,68 @@
+import gzip
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.log_analytics import LogAggregate, load_state, save_state, scan
+
+EVENTO = {
+    "schema": 1,
+    "event": "task",
+    "task_name": "logistica.procesar_entrega",
+    "status": "SUCCESS",
+    "duration_ms": 12.5,
+}
+
+
+def _escribir_gz(path, eventos):
+    with gzip.open(path, "wt", encoding="utf-8") as log_file:
+        for evento in eventos:
+            log_file.write(json.dumps(evento) + "\n")
+
+
+def _conteo(aggregate):
+    return sum(row["count"] for row in aggregate.rows())
+
+
+def test_scan_gz_no_cuenta_dos_veces(tmp_path):
+    path = str(tmp_path / "task_events.jsonl.gz")
+    _escribir_gz(path, [EVENTO])
+
+    aggregate = LogAggregate()
+    offsets = {}
+    scan([path], aggregate, offsets)
+    scan([path], aggregate, offsets)
+
+    assert _conteo(aggregate) == 1
+    assert offsets[path]["done"] is True
+
+
+def test_scan_gz_con_estado_persistido(tmp_path):
+    path = str(tmp_path / "task_events.jsonl.gz")
+    state = str(tmp_path / "state.json")
+    _escribir_gz(path, [EVENTO])
+
+    for _ in range(2):
+        offsets, aggregate = load_state(state)
+        aggregate = aggregate or LogAggregate()
+        scan([path], aggregate, offsets)
+        save_state(state, offsets, aggregate)
+
+    assert _conteo(load_state(state)[1]) == 1
+
+
+def test_scan_gz_reemplazado_se_vuelve_a_leer(tmp_path):
+    path = str(tmp_path / "task_events.jsonl.gz")
+    _escribir_gz(path, [EVENTO])
+
+    aggregate = LogAggregate()
+    offsets = {}
+    scan([path], aggregate, offsets)
+
+    # Un archivo nuevo en la misma ruta (otro tamaño) se procesa de nuevo
+    _escribir_gz(path, [EVENTO, EVENTO])
+    scan([path], aggregate, offsets)
+
+    assert _conteo(aggregate) == 3
@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("celery")
+pytest.importorskip("flask_sqlalchemy")
+pytest.importorskip("flask_restful")
+pytest.importorskip("cryptography")
+
+# La app de logística se crea al importar: usar una base SQLite en memoria
+os.environ["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+
+from celery.exceptions import Retry
+
+from celery_app import idempotency
+from celery_app.idempotency import idempotency_key
+from microservices.logistica_inventario import tasks
+from microservices.logistica_inventario.modelos import Entrega, db
+from scripts.utils import sign_celery_message
+
+INFO = {"direccion": "Calle 5 # 10-20", "nombre_recibe": "Juan", "firma_recibe": "firma"}
+
+
+class _Tarea:
+    """Sustituto del self de una tarea bind=True"""
+
+    def __init__(self, retries=0, task_id="tarea-1"):
+        self.request = types.SimpleNamespace(retries=retries, id=task_id, headers={}, eta=None)
+
+    def retry(self, countdown=None, max_retries=None, exc=None):
+        return Retry(exc=exc, when=countdown)
+
+
+@pytest.fixture(autouse=True)
+def entorno(monkeypatch):
+    monkeypatch.setenv("CELERY_SIGNING_KEY", "clave-de-prueba")
+    monkeypatch.setattr(tasks, "ENTREGA_GROUP_COMMIT", False)
+    # Sin la espera simulada del procesamiento (solo en el módulo de tareas)
+    monkeypatch.setattr(tasks, "time", types.SimpleNamespace(time=time.time, sleep=lambda *_: None))
+    with tasks.app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield
+
+
+@pytest.fixture
+def redis_fake(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(idempotency, "_client", client)
+    return client
+
+
+def _crear_entrega(estado="EN_RUTA"):
+    with tasks.app.app_context():
+        entrega = Entrega(direccion="Calle 1", pedido_id="P-1", estado=estado)
+        db.session.add(entrega)
+        db.session.commit()
+        return entrega.id
+
+
+def _entrega(entrega_id):
+    with tasks.app.app_context():
+        return Entrega.estado_actual(entrega_id)
+
+
+def _reservar_despacho(redis_fake, entrega_id, info=INFO):
+    """Reserva la llave "dispatch" como lo hace el servicio antes de encolar"""
+    key = idempotency_key(entrega_id, info)
+    idempotency.acquire("dispatch", key, "tarea-1")
+    return key
+
+
+def _llaves(redis_fake, key):
+    return {scope: redis_fake.get(f"idem:{scope}:{key}") for scope in ("dispatch", "worker")}
+
+
+def _procesar(tarea, entrega_id, status="ENTREGADA", info=INFO):
+    args = [entrega_id, status, 0, info]
+    return tasks.procesar_entrega_impl(
+        tarea,
+        *args,
+        signed_celery_message=sign_celery_message("logistica.procesar_entrega", args),
+    )
+
+
+def test_error_inesperado_libera_las_llaves(redis_fake, monkeypatch):
+    entrega_id = _crear_entrega()
+    key = _reservar_despacho(redis_fake, entrega_id)
+
+    def falla_cifrado(_valores):
+        raise RuntimeError("sin llave de cifrado")
+
+    monkeypatch.setattr(tasks, "encrypt_many", falla_cifrado)
+
+    with pytest.raises(RuntimeError):
+        _procesar(_Tarea(), entrega_id)
+
+    assert _llaves(redis_fake, key) == {"dispatch": None, "worker": None}
+    assert _entrega(entrega_id).estado == "EN_RUTA"
+
+
+def test_retry_conserva_las_llaves(redis_fake):
+    entrega_id = _crear_entrega()
+    key = _reservar_despacho(redis_fake, entrega_id)
+
+    with pytest.raises(Retry):
+        _procesar(_Tarea(), entrega_id, status="PENDING_SYSTEM_CONFIRMATION")
+
+    # El reintento comparte el task id y vuelve a tomar su propia llave
+    assert _llaves(redis_fake, key) == {"dispatch": "tarea-1", "worker": "tarea-1"}
+    assert _entrega(entrega_id).estado == "PENDING_SYSTEM_CONFIRMATION"
+
+
+def test_exito_conserva_la_llave_y_descarta_duplicados(redis_fake):
+    entrega_id = _crear_entrega()
+    key = _reservar_despacho(redis_fake, entrega_id)
+
+    assert _procesar(_Tarea(), entrega_id)["status"] == "ENTREGADA"
+    assert _llaves(redis_fake, key)["worker"] == "tarea-1"
+
+    duplicado = _procesar(_Tarea(task_id="tarea-2"), entrega_id)
+    assert duplicado["status"] == "DUPLICATE"
+    assert duplicado["duplicate_of"] == "tarea-1"
+
+
+def _reintento_disponible(monkeypatch):
+    # En el reintento el sistema responde y la tarea pasa a la transición final
+    monkeypatch.setattr(tasks, "_sistema_disponible", lambda: True)
+    return _Tarea(retries=1)
+
+
+def test_reintento_con_version_cambiada_devuelve_conflict(redis_fake, monkeypatch):
+    entrega_id = _crear_entrega(estado="PENDING_SYSTEM_CONFIRMATION")
+    key = _reservar_despacho(redis_fake, entrega_id)
+    tarea = _reintento_disponible(monkeypatch)
+
+    # Otra escritura cambia la entrega entre la lectura de la versión y el UPDATE
+    encrypt_many = tasks.encrypt_many
+
+    def escritura_concurrente(valores):
+        Entrega.transicionar(entrega_id, "EN_RUTA")
+        return encrypt_many(valores)
+
+    monkeypatch.setattr(tasks, "encrypt_many", escritura_concurrente)
+    resultado = _procesar(tarea, entrega_id, status="PENDING_SYSTEM_CONFIRMATION")
+
+    assert resultado["status"] == "CONFLICT"
+    assert resultado["estado_actual"] == "EN_RUTA"
+    assert _entrega(entrega_id).estado == "EN_RUTA"
+    assert _llaves(redis_fake, key) == {"dispatch": None, "worker": None}
+
+
+def test_reintento_sin_cambios_aplica_la_transicion(redis_fake, monkeypatch):
+    entrega_id = _crear_entrega(estado="PENDING_SYSTEM_CONFIRMATION")
+    version = _entrega(entrega_id).version
+    _reservar_despacho(redis_fake, entrega_id)
+
+    resultado = _procesar(
+        _reintento_disponible(monkeypatch), entrega_id, status="PENDING_SYSTEM_CONFIRMATION"
+    )
+
+    assert resultado["status"] == "ENTREGADA"
+    assert tuple(_entrega(entrega_id)) == ("ENTREGADA", version + 1)
+
+
+def test_reintento_de_entrega_ya_final_se_omite(redis_fake, monkeypatch):
+    entrega_id = _crear_entrega(estado="ENTREGADA")
+    key = _reservar_despacho(redis_fake, entrega_id)
+
+    resultado = _procesar(
+        _reintento_disponible(monkeypatch), entrega_id, status="PENDING_SYSTEM_CONFIRMATION"
+    )
+
+    assert resultado["status"] == "SKIPPED"
+    # La entrega ya se escribió: la llave se conserva para descartar duplicados
+    assert _llaves(redis_fake, key)["worker"] == "tarea-1"
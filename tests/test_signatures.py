@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("flask")
+pytest.importorskip("flask_jwt_extended")
+pytest.importorskip("bcrypt")
+pytest.importorskip("cryptography")
+
+from scripts.utils import sign_data, validate_signature, validate_signatures
+
+CLAVE = "clave-de-prueba"
+DATOS = [{"entrega_id": i, "status": "ENTREGADA"} for i in range(3)]
+
+
+def test_lote_valido_coincide_con_validate_signature():
+    items = [(data, sign_data(CLAVE, data)) for data in DATOS]
+
+    assert validate_signatures(CLAVE, items) == [True, True, True]
+    assert [validate_signature(CLAVE, data, firma) for data, firma in items] == [True, True, True]
+
+
+def test_lote_marca_solo_las_firmas_invalidas():
+    items = [(data, sign_data(CLAVE, data)) for data in DATOS]
+    items[1] = (DATOS[1], sign_data("otra-clave", DATOS[1]))
+
+    assert validate_signatures(CLAVE, items) == [True, False, True]
+
+
+def test_firma_no_string_no_rompe_el_lote():
+    items = [(DATOS[0], sign_data(CLAVE, DATOS[0])), (DATOS[1], None), (DATOS[2], 12345)]
+
+    assert validate_signatures(CLAVE, items) == [True, False, False]
+
+
+def test_firma_no_ascii_es_invalida():
+    firma = sign_data(CLAVE, DATOS[0])
+    items = [(DATOS[0], "ñ" + firma[1:]), (DATOS[1], sign_data(CLAVE, DATOS[1]))]
+
+    assert validate_signatures(CLAVE, items) == [False, True]
+
+
+def test_lote_vacio():
+    assert validate_signatures(CLAVE, []) == []
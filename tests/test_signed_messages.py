@@ -0,0 +1,78 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("flask")
+pytest.importorskip("flask_jwt_extended")
+pytest.importorskip("bcrypt")
+pytest.importorskip("cryptography")
+
+from scripts.utils import required_signed_celery_message, sign_celery_message, sign_data
+
+TASK = "logistica.procesar_entrega"
+ARGS = [7, "ENTREGADA", 0, {"firma_recibe": "Juan"}]
+
+
+@pytest.fixture(autouse=True)
+def _signing_key(monkeypatch):
+    monkeypatch.setenv("CELERY_SIGNING_KEY", "clave-de-prueba")
+
+
+def _legacy_kwargs(task_name, args):
+    info = {"task_name": task_name, "args": args}
+    return {
+        "signed_celery_message": sign_data("clave-de-prueba", info),
+        "info_internal": info,
+    }
+
+
+def test_compacto_valido():
+    kwargs = {"signed_celery_message": sign_celery_message(TASK, ARGS)}
+    assert required_signed_celery_message(kwargs, TASK, ARGS) is True
+
+
+def test_compacto_con_args_alterados():
+    kwargs = {"signed_celery_message": sign_celery_message(TASK, ARGS)}
+    with pytest.raises(ValueError):
+        required_signed_celery_message(kwargs, TASK, [8] + ARGS[1:])
+
+
+def test_compacto_con_otra_tarea():
+    kwargs = {"signed_celery_message": sign_celery_message(TASK, ARGS)}
+    with pytest.raises(ValueError):
+        required_signed_celery_message(kwargs, "logistica.otra_tarea", ARGS)
+
+
+def test_compacto_sin_task_name():
+    kwargs = {"signed_celery_message": sign_celery_message(TASK, ARGS)}
+    with pytest.raises(ValueError, match="task_name is required"):
+        required_signed_celery_message(kwargs, None, ARGS)
+
+
+def test_legacy_valido():
+    assert required_signed_celery_message(_legacy_kwargs(TASK, ARGS), TASK, ARGS) is True
+
+
+def test_legacy_sin_task_name_valida_solo_la_firma():
+    assert required_signed_celery_message(_legacy_kwargs(TASK, ARGS)) is True
+
+
+def test_legacy_con_args_distintos_a_los_recibidos():
+    # La firma es válida pero no corresponde a los args que recibió el worker
+    with pytest.raises(ValueError):
+        required_signed_celery_message(_legacy_kwargs(TASK, ARGS), TASK, [8] + ARGS[1:])
+
+
+def test_legacy_con_firma_alterada():
+    kwargs = _legacy_kwargs(TASK, ARGS)
+    kwargs["info_internal"] = {"task_name": TASK, "args": [8] + ARGS[1:]}
+    with pytest.raises(ValueError):
+        required_signed_celery_message(kwargs, TASK, [8] + ARGS[1:])
+
+
+def test_sin_firma():
+    with pytest.raises(ValueError, match="is required"):
+        required_signed_celery_message({}, TASK, ARGS)